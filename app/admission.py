@@ -0,0 +1,268 @@
+"""Admission control for the job API: queue depth, per-client cost, uploads, rate limit.
+
+任务在入队前估算「成本」（百万像素 × 步数），按以下限制准入，超出则返回 429：
+
+- 队列总深度（排队 + 处理中）
+- 每个客户端（API key 或 IP）已排队任务的总成本
+- 尚未处理完的上传字节数（以及单次上传大小）
+- /api/inputs 保存的输入图字节数（全局与每个客户端），直到存储回收删除该文件
+- 每个客户端的令牌桶限速
+
+Retry-After 依据 worker 实际处理速度（每单位成本耗时的滑动平均）估算。
+所有限制值为 0 时表示不限制。
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from .config import CONFIG
+
+
+class Rejected(Exception):
+    """Raised when a job is not admitted; maps to HTTP 429 (or 413 for oversized uploads)."""
+
+    def __init__(self, reason: str, detail: str, retry_after: int, status_code: int = 429) -> None:
+        super().__init__(detail)
+        self.reason = reason
+        self.detail = detail
+        self.retry_after = max(1, int(retry_after))
+        self.status_code = status_code
+
+
+def estimate_cost(
+    job_type: str,
+    *,
+    width: Optional[int],
+    height: Optional[int],
+    steps: Optional[int],
+    max_side: Optional[int] = None,
+    scale: Optional[float] = None,
+    strength: Optional[float] = None,
+    count: int = 1,
+    tiles: Optional[int] = None,
+    tile_pixels: Optional[int] = None,
+) -> float:
+    """Rough job cost in megapixel-steps (used for quotas and Retry-After).
+
+    hires 任务给出 tiles / tile_pixels 时按实际 tile 数计算重绘成本。
+    """
+    if width and height:
+        pixels = int(width) * int(height)
+    elif max_side:
+        pixels = int(max_side) ** 2
+    else:
+        pixels = CONFIG.width * CONFIG.height
+    n_steps = int(steps or CONFIG.num_inference_steps)
+    cost = pixels / 1e6 * n_steps
+
+    if job_type == "edit":
+        # Qwen Edit 模型更大，且需同时编码参考图
+        cost *= 4
+    elif job_type == "hires":
+        refine = float(strength or CONFIG.hires_strength)
+        if tiles and tile_pixels:
+            # 每个 tile 以 strength × steps 步做 img2img
+            cost += tiles * tile_pixels / 1e6 * n_steps * refine
+        else:
+            factor = float(scale or CONFIG.hires_scale)
+            cost += cost * factor * factor * refine
+    return cost * max(1, int(count))
+
+
+class _Bucket:
+    def __init__(self, capacity: float) -> None:
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+
+class AdmissionController:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, _Bucket] = {}
+        self._client_cost: Dict[str, float] = {}
+        self._jobs = 0
+        self._total_cost = 0.0
+        self._pending_upload_bytes = 0
+        # /api/inputs 文件名 -> (client, bytes)，由存储回收删除文件时释放
+        self._uploads: Dict[str, Tuple[str, int]] = {}
+        self._client_upload_bytes: Dict[str, int] = {}
+        self._stored_upload_bytes = 0
+        # 滑动平均：每单位成本耗时（秒）与每个任务耗时（秒）
+        self._sec_per_cost = 3.0
+        self._sec_per_job = 30.0
+        self.rejections: Dict[str, int] = {}
+        self.admitted = 0
+
+    @staticmethod
+    def client_key(api_key: Optional[str], host: Optional[str]) -> str:
+        # 只信任已登记的 key：否则每次换一个随机 key 就能拿到新的令牌桶与额度
+        if api_key and api_key in CONFIG.api_keys:
+            return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+        return "ip:" + (host or "unknown")
+
+    def _reject(self, reason: str, detail: str, retry_after: float, status_code: int = 429) -> Rejected:
+        self.rejections[reason] = self.rejections.get(reason, 0) + 1
+        return Rejected(reason, detail, math.ceil(retry_after), status_code)
+
+    def _take_token(self, client: str) -> Optional[float]:
+        """Consume one token; return seconds until the next token if empty."""
+        rate = CONFIG.rate_limit_per_minute / 60.0
+        if rate <= 0:
+            return None
+        burst = max(1.0, float(CONFIG.rate_limit_burst))
+        bucket = self._buckets.setdefault(client, _Bucket(burst))
+        now = time.monotonic()
+        bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+        bucket.updated = now
+        if bucket.tokens >= 1.0:
+            bucket.tokens -= 1.0
+            return None
+        return (1.0 - bucket.tokens) / rate
+
+    def check_upload_size(self, size: int) -> None:
+        limit = CONFIG.max_upload_mb * 1024 * 1024
+        if limit > 0 and size > limit:
+            with self._lock:
+                raise self._reject(
+                    "upload_too_large",
+                    f"Upload is {size} bytes; the limit is {int(limit)} bytes.",
+                    0,
+                    status_code=413,
+                )
+
+    def admit(self, client: str, cost: float, upload_bytes: int = 0, *, force: bool = False) -> None:
+        """Reserve capacity for one job or raise Rejected.
+
+        `force=True` skips all checks (used when requeueing persisted jobs on restart).
+        """
+        with self._lock:
+            if force:
+                self._reserve(client, cost, upload_bytes)
+                return
+
+            wait = self._take_token(client)
+            if wait is not None:
+                raise self._reject("rate_limited", "Too many requests; slow down.", wait)
+
+            max_depth = CONFIG.max_queue_depth
+            if max_depth > 0 and self._jobs >= max_depth:
+                raise self._reject(
+                    "queue_full",
+                    f"Queue is full ({self._jobs} jobs).",
+                    self._sec_per_job * (self._jobs - max_depth + 1),
+                )
+
+            max_cost = CONFIG.max_client_cost
+            queued = self._client_cost.get(client, 0.0)
+            if max_cost > 0 and queued + cost > max_cost:
+                excess = queued + cost - max_cost
+                raise self._reject(
+                    "client_quota",
+                    f"Too much queued work for this client ({queued:.1f} + {cost:.1f} > {max_cost:.1f}).",
+                    self._sec_per_cost * min(self._total_cost, max(excess, cost)),
+                )
+
+            max_bytes = CONFIG.max_pending_upload_mb * 1024 * 1024
+            if max_bytes > 0 and upload_bytes and self._pending_upload_bytes + upload_bytes > max_bytes:
+                raise self._reject(
+                    "uploads_pending",
+                    "Too many pending uploads on the server.",
+                    self._sec_per_job,
+                )
+
+            self._reserve(client, cost, upload_bytes)
+
+    def admit_upload(self, client: str, name: str, size: int) -> None:
+        """Admit one stored input upload (/api/inputs) or raise Rejected.
+
+        `size` 字节一直计入额度，直到 release_upload(name)（存储回收删除该文件）；
+        内容已存在时传 0，只消耗限速令牌。
+        """
+        with self._lock:
+            wait = self._take_token(client)
+            if wait is not None:
+                raise self._reject("rate_limited", "Too many requests; slow down.", wait)
+            if size <= 0:
+                return
+
+            # 额度要等存储回收删除过期输入后才释放
+            reclaim_after = max(CONFIG.gc_interval_s, CONFIG.input_max_age_hours * 3600)
+            max_client = CONFIG.max_client_upload_mb * 1024 * 1024
+            used = self._client_upload_bytes.get(client, 0)
+            if max_client > 0 and used + size > max_client:
+                raise self._reject(
+                    "client_uploads",
+                    f"Too many stored uploads for this client ({used} + {size} > {int(max_client)} bytes).",
+                    reclaim_after,
+                )
+            max_total = CONFIG.max_stored_upload_mb * 1024 * 1024
+            if max_total > 0 and self._stored_upload_bytes + size > max_total:
+                raise self._reject(
+                    "uploads_stored",
+                    "Too many stored uploads on the server.",
+                    reclaim_after,
+                )
+
+            self._uploads[name] = (client, size)
+            self._client_upload_bytes[client] = used + size
+            self._stored_upload_bytes += size
+
+    def release_upload(self, name: str) -> None:
+        with self._lock:
+            entry = self._uploads.pop(name, None)
+            if entry is None:
+                return
+            client, size = entry
+            self._stored_upload_bytes = max(0, self._stored_upload_bytes - size)
+            left = self._client_upload_bytes.get(client, 0) - size
+            if left > 0:
+                self._client_upload_bytes[client] = left
+            else:
+                self._client_upload_bytes.pop(client, None)
+
+    def _reserve(self, client: str, cost: float, upload_bytes: int) -> None:
+        self._jobs += 1
+        self._total_cost += cost
+        self._client_cost[client] = self._client_cost.get(client, 0.0) + cost
+        self._pending_upload_bytes += upload_bytes
+        self.admitted += 1
+
+    def release(self, client: str, cost: float, upload_bytes: int = 0) -> None:
+        with self._lock:
+            self._jobs = max(0, self._jobs - 1)
+            self._total_cost = max(0.0, self._total_cost - cost)
+            left = self._client_cost.get(client, 0.0) - cost
+            if left > 1e-9:
+                self._client_cost[client] = left
+            else:
+                self._client_cost.pop(client, None)
+            self._pending_upload_bytes = max(0, self._pending_upload_bytes - upload_bytes)
+
+    def record_duration(self, seconds: float, cost: float) -> None:
+        """Update the drain-speed estimate from one finished job."""
+        alpha = 0.3
+        with self._lock:
+            self._sec_per_job = (1 - alpha) * self._sec_per_job + alpha * seconds
+            if cost > 0:
+                self._sec_per_cost = (1 - alpha) * self._sec_per_cost + alpha * (seconds / cost)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "queued_jobs": self._jobs,
+                "queued_cost": round(self._total_cost, 2),
+                "pending_upload_bytes": self._pending_upload_bytes,
+                "stored_upload_bytes": self._stored_upload_bytes,
+                "clients": len(self._client_cost),
+                "sec_per_job": round(self._sec_per_job, 2),
+                "sec_per_cost": round(self._sec_per_cost, 3),
+                "admitted": self.admitted,
+                "rejections": dict(self.rejections),
+            }
+
+
+ADMISSION = AdmissionController()
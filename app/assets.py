@@ -0,0 +1,97 @@
+"""HTTP delivery helpers for generated assets: stat-based ETags and metadata cache.
+
+- `version_token()`：由 (mtime_ns, size) 派生的版本号。assets/ 中的文件只写一次、
+  不会原地修改，因此它与内容哈希同样可靠，却无需读取文件（不会阻塞事件循环）
+- `read_metadata()`：PNG 文本元数据，按文件状态缓存，避免每次列表都重新打开所有图片
+- `AssetFiles`：StaticFiles 子类，使用版本号作为 ETag；URL 带 `?v=<版本号>` 时
+  视为内容寻址，返回 immutable 长缓存，否则要求客户端用 ETag 重新验证。
+  Range 请求由 Starlette 的 FileResponse 处理。
+"""
+from __future__ import annotations
+
+import os
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+from PIL import Image
+from starlette.datastructures import Headers, QueryParams
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+_lock = threading.Lock()
+_meta_cache: Dict[str, Tuple[Tuple[int, int], dict]] = {}
+
+
+def _file_key(st: os.stat_result) -> Tuple[int, int]:
+    return (st.st_mtime_ns, st.st_size)
+
+
+def version_token(st: os.stat_result) -> str:
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def _cache_path(path: str) -> str:
+    # 列表接口传相对路径、存储回收传绝对路径：统一成绝对路径作为缓存键
+    return os.path.abspath(path)
+
+
+def read_metadata(path: str, st: os.stat_result = None) -> dict:
+    st = st or os.stat(path)
+    key = _file_key(st)
+    with _lock:
+        cached = _meta_cache.get(_cache_path(path))
+    if cached and cached[0] == key:
+        return cached[1]
+
+    with Image.open(path) as img:
+        # Copy info to avoid keeping file open
+        metadata = img.info.copy()
+    with _lock:
+        _meta_cache[_cache_path(path)] = (key, metadata)
+    return metadata
+
+
+def forget(path: str) -> None:
+    with _lock:
+        _meta_cache.pop(_cache_path(path), None)
+
+
+def etag_matches(request_headers: Headers, etag: str) -> bool:
+    tags = [t.strip() for t in request_headers.get("if-none-match", "").split(",")]
+    return etag in tags or f"W/{etag}" in tags or "*" in tags
+
+
+class AssetFiles(StaticFiles):
+    def __init__(self, *args, on_access: Optional[Callable[[str], None]] = None, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        # 每次文件被访问时回调（文件名），供存储管理按最近访问时间淘汰
+        self.on_access = on_access
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        token = version_token(stat_result)
+        etag = f'"{token}"'
+
+        version = QueryParams(scope.get("query_string", b"")).get("v")
+        cache_control = IMMUTABLE if version == token else REVALIDATE
+
+        if self.on_access is not None:
+            self.on_access(os.path.basename(str(full_path)))
+
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        response.headers["etag"] = etag
+        response.headers["cache-control"] = cache_control
+        if etag_matches(request_headers, etag):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,110 @@
+"""Quality / speed comparison of quantized loading modes.
+
+用法：
+    python -m app.bench_quant --prompt "..." --modes none int8 int4
+
+每个模式依次：重新加载 pipeline（计时）→ 以相同 seed 出图（计时）→
+与 `none`（全精度）结果对比 PSNR / 平均绝对误差。图片保存在 --out-dir 下。
+"""
+import argparse
+import math
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+import torch
+
+from .config import CONFIG, QUANTIZE_MODES
+from .generate import generate_image
+from .pipeline import get_pipeline, reset_pipelines
+
+
+def _peak_memory_gb() -> Optional[float]:
+    try:
+        if CONFIG.device == "mps":
+            return torch.mps.driver_allocated_memory() / float(1024 ** 3)
+        if CONFIG.device == "cuda":
+            return torch.cuda.max_memory_allocated() / float(1024 ** 3)
+    except Exception:
+        pass
+    try:
+        import psutil  # type: ignore
+
+        return psutil.Process().memory_info().rss / float(1024 ** 3)
+    except Exception:
+        return None
+
+
+def _compare(a: Path, b: Path) -> tuple[float, float]:
+    """Return (PSNR in dB, mean absolute error on 0-255) between two images."""
+    x = np.asarray(Image.open(a).convert("RGB"), dtype=np.float64)
+    y = np.asarray(Image.open(b).convert("RGB"), dtype=np.float64)
+    if x.shape != y.shape:
+        return float("nan"), float("nan")
+    mse = float(np.mean((x - y) ** 2))
+    psnr = float("inf") if mse == 0 else 20 * math.log10(255.0) - 10 * math.log10(mse)
+    return psnr, float(np.mean(np.abs(x - y)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare quantized loading modes (quality & speed).")
+    parser.add_argument("--prompt", required=True, help="Prompt used for every mode.")
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        default=["none", *QUANTIZE_MODES],
+        choices=["none", *QUANTIZE_MODES],
+        help="Modes to compare; the first one is used as the reference.",
+    )
+    parser.add_argument("--height", type=int, default=None)
+    parser.add_argument("--width", type=int, default=None)
+    parser.add_argument("--steps", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--runs", type=int, default=2, help="Timed generations per mode (after load).")
+    parser.add_argument("--out-dir", default="assets/bench_quant", help="Where to save the images.")
+    args = parser.parse_args()
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    rows = []
+    reference: Optional[Path] = None
+    for mode in args.modes:
+        CONFIG.quantize = None if mode == "none" else mode
+        reset_pipelines()
+
+        t0 = time.perf_counter()
+        get_pipeline()
+        load_s = time.perf_counter() - t0
+
+        times = []
+        path = out_dir / f"{mode}.png"
+        for _ in range(max(1, args.runs)):
+            t0 = time.perf_counter()
+            generate_image(
+                prompt=args.prompt,
+                height=args.height,
+                width=args.width,
+                num_inference_steps=args.steps,
+                seed=args.seed,
+                output_path=str(path),
+            )
+            times.append(time.perf_counter() - t0)
+
+        if reference is None:
+            reference = path
+        psnr, mae = _compare(reference, path)
+        rows.append((mode, load_s, min(times), _peak_memory_gb(), psnr, mae))
+
+    print()
+    print(f"{'mode':<6} {'load(s)':>8} {'gen(s)':>8} {'mem(GB)':>8} {'PSNR(dB)':>9} {'MAE':>7}")
+    for mode, load_s, gen_s, mem, psnr, mae in rows:
+        mem_s = f"{mem:.2f}" if mem is not None else "n/a"
+        print(f"{mode:<6} {load_s:>8.1f} {gen_s:>8.2f} {mem_s:>8} {psnr:>9.2f} {mae:>7.2f}")
+    print(f"\nImages saved to {out_dir.resolve()} (reference: {args.modes[0]})")
+
+
+if __name__ == "__main__":
+    main()
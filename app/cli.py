@@ -1,6 +1,9 @@
 import argparse
 
+from .config import CONFIG, MEMORY_PROFILES, QUANTIZE_MODES
 from .generate import generate_image
+from .hires import hires_image
+from .variations import generate_variations
 
 
 def main() -> None:
@@ -41,9 +44,60 @@ def main() -> None:
         ),
     )
 
+    parser.add_argument(
+        "--memory-profile",
+        choices=("auto",) + MEMORY_PROFILES,
+        default=None,
+        help="Memory profile (default auto: chosen from resolution and free memory).",
+    )
+
+    parser.add_argument(
+        "--step-cache",
+        type=float,
+        default=None,
+        help="Step-cache threshold: reuse transformer outputs between similar steps (0 = off, 0.1 balanced).",
+    )
+    parser.add_argument(
+        "--quantize",
+        choices=QUANTIZE_MODES,
+        default=None,
+        help="Weight-only quantization of transformer + text encoder (requires optimum-quanto).",
+    )
+    parser.add_argument(
+        "--hires",
+        action="store_true",
+        help="Generate at base size, upscale, then refine in overlapping tiles.",
+    )
+    parser.add_argument("--hires-scale", type=float, default=None, help="Upscale factor for --hires (default 2.0).")
+    parser.add_argument(
+        "--hires-strength",
+        type=float,
+        default=None,
+        help="Tile refine strength for --hires (default 0.35).",
+    )
+    parser.add_argument("--tile-size", type=int, default=None, help="Tile size for --hires (default 1024).")
+    parser.add_argument("--tile-overlap", type=int, default=None, help="Tile overlap for --hires (default 128).")
+
+    parser.add_argument(
+        "--variations",
+        type=int,
+        default=None,
+        help="Generate N variations (random seeds) in one batched run plus a contact sheet.",
+    )
+    parser.add_argument(
+        "--seeds",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Explicit seeds for --variations (overrides N).",
+    )
+
     args = parser.parse_args()
 
-    path = generate_image(
+    if args.quantize:
+        CONFIG.quantize = args.quantize
+
+    common = dict(
         prompt=args.prompt,
         negative_prompt=args.negative,
         height=args.height,
@@ -52,8 +106,42 @@ def main() -> None:
         guidance_scale=args.guidance,
         seed=args.seed,
         output_path=args.output,
+        memory_profile=args.memory_profile,
+        step_cache=args.step_cache,
     )
 
+    if args.variations or args.seeds:
+        def on_image(done: int, total: int, step: int, steps: int) -> None:
+            print(f"Variations: {done}/{total} done (step {step}/{steps})", flush=True)
+
+        common.pop("seed")
+        common.pop("output_path")
+        paths, sheet = generate_variations(
+            **common,
+            seeds=args.seeds,
+            count=args.variations or 4,
+            progress=on_image,
+        )
+        for p in paths:
+            print(f"Image saved to {p.resolve()}")
+        print(f"Contact sheet saved to {sheet.resolve()}")
+        return
+
+    if args.hires:
+        def on_progress(done: int, total: int) -> None:
+            print(f"Refined tiles: {done}/{total}", flush=True)
+
+        path = hires_image(
+            **common,
+            scale=args.hires_scale,
+            strength=args.hires_strength,
+            tile_size=args.tile_size,
+            tile_overlap=args.tile_overlap,
+            progress=on_progress,
+        )
+    else:
+        path = generate_image(**common)
+
     print(f"Image saved to {path.resolve()}")
 
 
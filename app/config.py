@@ -1,4 +1,6 @@
 from dataclasses import dataclass
+from typing import Optional
+import os
 import platform
 
 import torch
@@ -32,6 +34,18 @@ def select_dtype(device: str) -> torch.dtype:
     return torch.float32
 
 
+# 内存档位（从快到省内存排列）：
+# - fast:     全部权重常驻设备，不做任何切片
+# - balanced: 开启 VAE tiling/slicing 与 attention slicing
+# - low_mem:  在 balanced 基础上按模块 CPU offload（model offload）
+# - min_mem:  逐层顺序 offload（sequential offload），最慢但峰值内存最低
+MEMORY_PROFILES = ("fast", "balanced", "low_mem", "min_mem")
+
+
+# Weight-only 量化模式（基于 optimum-quanto，需额外安装）。
+QUANTIZE_MODES = ("int8", "int4")
+
+
 _DEVICE = detect_device()
 _DTYPE = select_dtype(_DEVICE)
 
@@ -51,6 +65,82 @@ class ZImageConfig:
     device: str = _DEVICE
     torch_dtype: torch.dtype = _DTYPE
 
+    # Weight-only 量化（transformer + text encoder）：None 表示不量化，
+    # 可选 QUANTIZE_MODES 中的 "int8" / "int4"。生成与编辑模型分别配置，
+    # 也可通过环境变量 ZIMAGE_QUANTIZE / ZIMAGE_EDIT_QUANTIZE 设置。
+    quantize: Optional[str] = os.getenv("ZIMAGE_QUANTIZE") or None
+    edit_quantize: Optional[str] = os.getenv("ZIMAGE_EDIT_QUANTIZE") or None
+    # 量化后的权重缓存目录，避免每次启动都重新量化。
+    quantize_cache_dir: str = ".zimage_quantized"
+
+    # 本地预转换快照（python -m app.prepare_model 生成）：已按目标 dtype 保存为
+    # safetensors，启动时直接 mmap 加载，无需访问 Hub、也无需再做 dtype 转换。
+    snapshot_dir: str = os.getenv("ZIMAGE_SNAPSHOT_DIR", ".zimage_snapshots")
+    # 离线模式：只使用本地快照 / 本地 HF 缓存，不发起任何网络请求。
+    offline: bool = os.getenv("ZIMAGE_OFFLINE", "0") == "1"
+
+    # 精度策略：
+    # - "safe":     始终使用 torch_dtype（float32），与以往行为一致
+    # - "adaptive": 先以 fast_dtype autocast（和/或编译 transformer）运行，
+    #               检测到 NaN/Inf 时自动以 float32 重跑
+    precision: str = os.getenv("ZIMAGE_PRECISION", "safe")
+    fast_dtype: Optional[torch.dtype] = torch.float16
+    fast_compile: bool = False
+    # 同一分辨率下快速配置至少运行 precision_min_runs 次后，
+    # 回退率 >= precision_max_fallback_rate 即停用该配置。
+    precision_min_runs: int = 5
+    precision_max_fallback_rate: float = 0.2
+
+    # 步间特征缓存（见 app/step_cache.py）：相对变化阈值，0 表示关闭。
+    # 经验值：0.05 几乎无损，0.1 均衡，0.2 更快但细节略有损失。
+    step_cache_threshold: float = 0.0
+    # 前若干步总是完整计算；最多连续跳过的步数。
+    step_cache_warmup: int = 2
+    step_cache_max_skip: int = 2
+
+    # 编辑输入缓存（见 app/input_cache.py）的内存上限（MB），0 表示关闭。
+    input_cache_max_mb: float = 512.0
+
+    # 任务准入限制（见 app/admission.py），0 表示不限制。成本单位：百万像素 × 步数。
+    max_queue_depth: int = int(os.getenv("ZIMAGE_MAX_QUEUE", "32"))
+    max_client_cost: float = float(os.getenv("ZIMAGE_MAX_CLIENT_COST", "300"))
+    max_upload_mb: float = 25.0
+    max_pending_upload_mb: float = 512.0
+    # /api/inputs 保存的输入图：在存储回收删除之前一直计入（全局 / 每个客户端）
+    max_stored_upload_mb: float = 2048.0
+    max_client_upload_mb: float = 256.0
+    # 允许作为客户端身份的 X-API-Key（逗号分隔）；不在列表中的 key 被忽略，按 IP 计。
+    api_keys: tuple = tuple(k.strip() for k in os.getenv("ZIMAGE_API_KEYS", "").split(",") if k.strip())
+    # 每个客户端（已登记的 X-API-Key 或 IP）的令牌桶：每分钟补充数量 / 桶容量
+    rate_limit_per_minute: float = float(os.getenv("ZIMAGE_RATE_LIMIT", "30"))
+    rate_limit_burst: int = 10
+
+    # 存储回收（见 app/storage.py），0 表示不限制。
+    asset_quota_mb: float = float(os.getenv("ZIMAGE_ASSET_QUOTA_MB", "0"))
+    asset_max_age_days: float = 0.0
+    # 未被任务引用的临时输入在宽限期后删除；内容寻址上传按最近使用时间过期。
+    input_orphan_grace_s: float = 600.0
+    input_max_age_hours: float = 24.0
+    gc_interval_s: float = 30.0
+    gc_batch: int = 200
+    # 置顶（不回收）的资源列表；不能放在对外提供静态访问的 assets/ 下。
+    pins_file: str = ".zimage_pinned.json"
+
+    # 多图变体（见 app/variations.py）：单任务最多张数、每次送入 pipeline 的张数、
+    # 拼图（contact sheet）中每张缩略图的最大边长
+    max_variations: int = 8
+    variations_batch: int = 4
+    contact_sheet_thumb: int = 384
+
+    # 任务持久化与优雅停机（见 app/jobstore.py）
+    job_store_dir: str = ".zimage_jobs"
+    # 已结束任务记录的保留时长（小时），用于重启后继续响应轮询
+    job_record_ttl_hours: float = 24.0
+    # 收到 SIGTERM 后等待当前任务完成的最长时间（秒），超时则重启后重跑
+    shutdown_timeout_s: float = float(os.getenv("ZIMAGE_SHUTDOWN_TIMEOUT", "300"))
+    # /api/generate/sync 最长等待时间（秒），客户端传入的 timeout 会被截断到此值
+    sync_max_wait_s: float = 600.0
+
     # Default image size and sampling params（高质量模式）
     # 使用官方推荐配置：1024×1024, 9 步；如需加速可在 CLI 中自行下调。
     height: int = 1024
@@ -58,5 +148,30 @@ class ZImageConfig:
     num_inference_steps: int = 9
     guidance_scale: float = 0.0   # Turbo models 建议保持 0.0
 
+    # 内存档位："auto" 表示按分辨率与可用内存为每个任务自动选择，
+    # 也可固定为 MEMORY_PROFILES 中的任意一个。
+    memory_profile: str = "auto"
+
+    # auto 模式下的像素阈值（宽×高，超过即切换到更省内存的档位）。
+    # 编辑任务还需编码参考图，按两倍像素计算。
+    balanced_pixels: int = 1024 * 1024
+    low_mem_pixels: int = 1536 * 1536
+    min_mem_pixels: int = 2048 * 2048
+
+    # 可用内存低于该值（GB）时，auto 模式额外降一档。
+    low_memory_gb: float = 8.0
+
+    # Hires（分块放大）模式：先按基础分辨率出图，放大后分块低强度重绘。
+    hires_scale: float = 2.0
+    hires_strength: float = 0.35
+    hires_tile_size: int = 1024
+    hires_tile_overlap: int = 128
+    # 每次送入 pipeline 的 tile 数；峰值内存约为 tile_batch × 单个 tile。
+    hires_tile_batch: int = 2
+    # 参数上限：放大倍数过大时放大图与拼接缓冲区随输出尺寸增长；
+    # tile 过小会导致 pipeline 调用次数暴增。
+    hires_max_scale: float = 4.0
+    hires_min_tile: int = 256
+
 
 CONFIG = ZImageConfig()
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import io
 from pathlib import Path
 from typing import Optional
 from datetime import datetime
@@ -9,7 +10,10 @@ from PIL import PngImagePlugin
 import torch
 
 from .config import CONFIG
-from .pipeline import get_edit_pipeline
+from .input_cache import INPUT_CACHE, InputEntry, cache_key, hash_bytes, reuse_vae_encodings
+from .pipeline import get_edit_pipeline, resolve_memory_profile
+from .precision import run_with_precision
+from .step_cache import step_cache as _step_cache
 
 
 def _round_to_multiple_of_16(x: int) -> int:
@@ -78,11 +82,16 @@ def edit_image(
     guidance_scale: Optional[float] = None,
     seed: Optional[int] = 42,
     output_path: Optional[str] = None,
+    memory_profile: Optional[str] = None,
+    step_cache: Optional[float] = None,
+    info: Optional[dict] = None,
 ) -> Path:
     """Edit an input image with an "edit" pipeline (Qwen Image Edit preferred).
 
     If an instruction-edit pipeline is available (e.g. QwenImageEditPlusPipeline),
     we use it; otherwise we fallback to img2img.
+
+    `memory_profile` / `step_cache` / `info` 的含义同 generate_image。
     """
 
     pipe = get_edit_pipeline()
@@ -96,24 +105,40 @@ def edit_image(
     if not input_path.exists():
         raise FileNotFoundError(f"Input image not found: {input_path}")
 
-    init_image = Image.open(input_path).convert("RGB")
+    # 按内容哈希复用预处理结果与 VAE 编码（同一张图反复编辑时省去重复计算）。
+    data = input_path.read_bytes()
+    model_id = str(getattr(getattr(pipe, "config", None), "_name_or_path", "") or CONFIG.edit_model_id)
+    key = cache_key(hash_bytes(data), width=width, height=height, max_side=max_side, model_id=model_id)
+    entry = INPUT_CACHE.get(key) if CONFIG.input_cache_max_mb > 0 else None
+    input_cache_hit = entry is not None
+
+    if entry is None:
+        init_image = Image.open(io.BytesIO(data)).convert("RGB")
+
+        # Keep original size unless explicitly overridden.
+        w = int(width) if width is not None else init_image.width
+        h = int(height) if height is not None else init_image.height
 
-    # Keep original size unless explicitly overridden.
-    w = int(width) if width is not None else init_image.width
-    h = int(height) if height is not None else init_image.height
+        # If user didn't force width/height, apply max_side downscale for speed on macOS.
+        resize_info: dict = {}
+        if width is None and height is None:
+            init_image, resize_info = _apply_max_side_resize(init_image, max_side=max_side)
+            w, h = init_image.size
 
-    # If user didn't force width/height, apply max_side downscale for speed on macOS.
-    resize_info: dict = {}
-    if width is None and height is None:
-        init_image, resize_info = _apply_max_side_resize(init_image, max_side=max_side)
-        w, h = init_image.size
+        # Ensure divisible by 16 to prevent runtime errors.
+        w = _round_to_multiple_of_16(int(w))
+        h = _round_to_multiple_of_16(int(h))
 
-    # Ensure divisible by 16 to prevent runtime errors.
-    w = _round_to_multiple_of_16(int(w))
-    h = _round_to_multiple_of_16(int(h))
+        if (w, h) != (init_image.width, init_image.height):
+            init_image = init_image.resize((w, h), Image.LANCZOS)
 
-    if (w, h) != (init_image.width, init_image.height):
-        init_image = init_image.resize((w, h), Image.LANCZOS)
+        entry = InputEntry(init_image, resize_info)
+        if CONFIG.input_cache_max_mb > 0:
+            INPUT_CACHE.put(key, entry)
+
+    init_image = entry.image
+    resize_info = entry.resize_info
+    w, h = init_image.size
 
     # Introspect pipeline signature to decide defaults & supported params.
     sig = None
@@ -135,14 +160,15 @@ def edit_image(
     if is_instruction_edit and (neg is None or str(neg).strip() == ""):
         neg = " "
 
-    generator = torch.Generator(device=CONFIG.device)
-    if seed is not None:
-        generator = generator.manual_seed(int(seed))
+    profile = resolve_memory_profile(memory_profile, h, w, edit=True)
+    cache_threshold = step_cache if step_cache is not None else CONFIG.step_cache_threshold
+    cache_stats: dict = {}
 
     print(
         "Editing with: "
         f"prompt='{prompt}', neg='{neg}', w={w}, h={h}, steps={steps}, "
-        f"scale={scale}, strength={strength}, seed={seed}, input='{input_path}'",
+        f"scale={scale}, strength={strength}, seed={seed}, memory={profile}, "
+        f"input='{input_path}' (cache {'hit' if input_cache_hit else 'miss'})",
         flush=True,
     )
 
@@ -154,7 +180,6 @@ def edit_image(
         "height": h,
         "width": w,
         "num_inference_steps": steps,
-        "generator": generator,
     }
 
     # Keep prompt length modest for speed if supported.
@@ -173,8 +198,25 @@ def edit_image(
     if sig is not None and "true_cfg_scale" in sig.parameters:
         kwargs.setdefault("true_cfg_scale", 4.0)
 
-    with torch.inference_mode():
-        result = pipe(**kwargs)
+    def _run(extra: dict):
+        # 每次调用都重建 generator，保证降档 / 回退重跑时结果仍可复现。
+        generator = torch.Generator(device=CONFIG.device)
+        if seed is not None:
+            generator = generator.manual_seed(int(seed))
+        with torch.inference_mode(), reuse_vae_encodings(pipe, entry), \
+                _step_cache(pipe, cache_threshold, steps) as cache:
+            result = pipe(**kwargs, generator=generator, **extra)
+        if cache is not None:
+            cache_stats.update(cache.stats())
+        return result
+
+    images, profile, precision = run_with_precision(pipe, "edit", profile, h, w, _run)
+    if info is not None:
+        info["memory_profile"] = profile
+        info["precision"] = precision
+        info["input_cache_hit"] = input_cache_hit
+        if cache_stats:
+            info["step_cache"] = cache_stats
 
     if output_path is None:
         ts = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
@@ -199,11 +241,15 @@ def edit_image(
     metadata.add_text("strength", str(strength_val))
     if seed is not None:
         metadata.add_text("seed", str(seed))
+    metadata.add_text("memory_profile", profile)
+    metadata.add_text("precision", precision)
+    if cache_stats:
+        metadata.add_text("step_cache", str(cache_threshold))
     metadata.add_text("input_image", str(input_path.name))
     # Record which model is being used for edit (usually Qwen/Qwen-Image-Edit-2511)
     metadata.add_text("edit_model_id", str(getattr(CONFIG, "edit_model_id", "")))
 
-    image = result.images[0]
+    image = images[0]
     out = Path(output_path)
     if not out.is_absolute():
         out.parent.mkdir(parents=True, exist_ok=True)
@@ -6,7 +6,9 @@ from PIL import PngImagePlugin
 import torch
 
 from .config import CONFIG
-from .pipeline import get_pipeline
+from .pipeline import get_pipeline, resolve_memory_profile
+from .precision import run_with_precision
+from .step_cache import step_cache as _step_cache
 
 
 def generate_image(
@@ -18,8 +20,16 @@ def generate_image(
     guidance_scale: Optional[float] = None,
     seed: Optional[int] = 42,
     output_path: Optional[str] = None,
+    memory_profile: Optional[str] = None,
+    step_cache: Optional[float] = None,
+    info: Optional[dict] = None,
 ) -> Path:
-    """Generate a single image with Z-Image-Turbo and save it to disk."""
+    """Generate a single image with Z-Image-Turbo and save it to disk.
+
+    `memory_profile` 为 None 时使用 CONFIG.memory_profile（默认 auto）；
+    `step_cache` 为步间缓存阈值，None 时使用 CONFIG.step_cache_threshold（0 为关闭）。
+    若传入 `info` 字典，会写入本次实际使用的参数（如 memory_profile、precision）。
+    """
     pipe = get_pipeline()
 
     h = height or CONFIG.height
@@ -32,21 +42,38 @@ def generate_image(
     steps = num_inference_steps or CONFIG.num_inference_steps
     scale = guidance_scale if guidance_scale is not None else CONFIG.guidance_scale
 
-    generator = torch.Generator(device=CONFIG.device)
-    if seed is not None:
-        generator = generator.manual_seed(seed)
+    profile = resolve_memory_profile(memory_profile, h, w)
+    cache_threshold = step_cache if step_cache is not None else CONFIG.step_cache_threshold
+    cache_stats: dict = {}
+
+    print(f"Generating with: prompt='{prompt}', neg='{negative_prompt}', h={h}, w={w}, steps={steps}, scale={scale}, seed={seed}, memory={profile}")
 
-    print(f"Generating with: prompt='{prompt}', neg='{negative_prompt}', h={h}, w={w}, steps={steps}, scale={scale}, seed={seed}")
+    def _run(extra: dict):
+        # 每次调用都重建 generator，保证降档 / 回退重跑时结果仍可复现。
+        generator = torch.Generator(device=CONFIG.device)
+        if seed is not None:
+            generator = generator.manual_seed(seed)
+        with _step_cache(pipe, cache_threshold, steps) as cache:
+            result = pipe(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                height=h,
+                width=w,
+                num_inference_steps=steps,
+                guidance_scale=scale,
+                generator=generator,
+                **extra,
+            )
+        if cache is not None:
+            cache_stats.update(cache.stats())
+        return result
 
-    result = pipe(
-        prompt=prompt,
-        negative_prompt=negative_prompt,
-        height=h,
-        width=w,
-        num_inference_steps=steps,
-        guidance_scale=scale,
-        generator=generator,
-    )
+    images, profile, precision = run_with_precision(pipe, "generate", profile, h, w, _run)
+    if info is not None:
+        info["memory_profile"] = profile
+        info["precision"] = precision
+        if cache_stats:
+            info["step_cache"] = cache_stats
 
     # 若未显式指定输出路径，则按时间戳生成：
     # assets/output_YYYY-MM-DD_HH-mm-ss.png
@@ -65,8 +92,12 @@ def generate_image(
     metadata.add_text("scale", str(scale))
     if seed is not None:
         metadata.add_text("seed", str(seed))
+    metadata.add_text("memory_profile", profile)
+    metadata.add_text("precision", precision)
+    if cache_stats:
+        metadata.add_text("step_cache", str(cache_threshold))
 
-    image = result.images[0]
+    image = images[0]
     path = Path(output_path)
     # 默认将图片存放在项目根目录下的 assets/ 目录中；若目录不存在则自动创建。
     if not path.is_absolute():
@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import inspect
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+from PIL import PngImagePlugin
+import torch
+
+from .config import CONFIG
+from .generate import generate_image
+from .pipeline import (
+    get_img2img_pipeline,
+    resolve_memory_profile,
+    run_with_memory_profile,
+)
+
+
+def _round_to_multiple_of_16(x: int) -> int:
+    return max(16, (x // 16) * 16)
+
+
+def _tile_starts(total: int, tile: int, overlap: int) -> List[int]:
+    """Start offsets covering [0, total) with tiles of `tile` px overlapping by `overlap`."""
+    if total <= tile:
+        return [0]
+    stride = max(16, tile - overlap)
+    starts = list(range(0, total - tile, stride))
+    starts.append(total - tile)
+    return starts
+
+
+def _feather_mask(
+    w: int,
+    h: int,
+    overlap: int,
+    *,
+    left: bool,
+    top: bool,
+    right: bool,
+    bottom: bool,
+) -> np.ndarray:
+    """Blend weights for one tile: linear ramps on edges shared with neighbours.
+
+    贴图像外边界的一侧不做羽化；权重始终 > 0，避免除零。
+    """
+    mx = np.ones(w, dtype=np.float32)
+    my = np.ones(h, dtype=np.float32)
+    if overlap > 0:
+        ramp = np.linspace(1.0 / (overlap + 1), 1.0, overlap, dtype=np.float32)
+        n = min(overlap, w)
+        if left:
+            mx[:n] = np.minimum(mx[:n], ramp[:n])
+        if right:
+            mx[-n:] = np.minimum(mx[-n:], ramp[:n][::-1])
+        n = min(overlap, h)
+        if top:
+            my[:n] = np.minimum(my[:n], ramp[:n])
+        if bottom:
+            my[-n:] = np.minimum(my[-n:], ramp[:n][::-1])
+    return np.outer(my, mx)[:, :, None]
+
+
+class TilePlan(NamedTuple):
+    factor: float
+    strength: float
+    out_w: int
+    out_h: int
+    tile: int
+    tile_w: int
+    tile_h: int
+    overlap: int
+    boxes: List[Tuple[int, int, int, int]]
+
+
+def plan_tiles(
+    height: Optional[int] = None,
+    width: Optional[int] = None,
+    scale: Optional[float] = None,
+    strength: Optional[float] = None,
+    tile_size: Optional[int] = None,
+    tile_overlap: Optional[int] = None,
+) -> TilePlan:
+    """Validate hires parameters and compute the output size and tile grid.
+
+    不加载模型，供服务端在入队前校验参数、按实际 tile 数估算成本。
+    Raises ValueError for out-of-range parameters.
+    """
+    factor = float(scale if scale is not None else CONFIG.hires_scale)
+    if not (1.0 <= factor <= CONFIG.hires_max_scale):
+        raise ValueError(f"scale must be between 1.0 and {CONFIG.hires_max_scale}.")
+    strength_val = float(strength if strength is not None else CONFIG.hires_strength)
+    if not (0.0 < strength_val <= 1.0):
+        raise ValueError("strength must be in (0, 1].")
+    tile_req = int(tile_size or CONFIG.hires_tile_size)
+    if tile_req < CONFIG.hires_min_tile:
+        raise ValueError(f"tile_size must be >= {CONFIG.hires_min_tile}.")
+    tile = _round_to_multiple_of_16(tile_req)
+    overlap = int(tile_overlap if tile_overlap is not None else CONFIG.hires_tile_overlap)
+    if not (0 <= overlap < tile / 2):
+        raise ValueError("tile_overlap must be >= 0 and less than half of tile_size.")
+
+    # 与 generate_image() 相同的取整规则得到基础尺寸
+    base_h = ((height or CONFIG.height) // 16) * 16
+    base_w = ((width or CONFIG.width) // 16) * 16
+    out_w = _round_to_multiple_of_16(int(base_w * factor))
+    out_h = _round_to_multiple_of_16(int(base_h * factor))
+
+    tile_w = min(tile, out_w)
+    tile_h = min(tile, out_h)
+    overlap = max(0, min(overlap, tile_w // 2, tile_h // 2))
+    boxes = [
+        (x, y, x + tile_w, y + tile_h)
+        for y in _tile_starts(out_h, tile_h, overlap)
+        for x in _tile_starts(out_w, tile_w, overlap)
+    ]
+    return TilePlan(factor, strength_val, out_w, out_h, tile, tile_w, tile_h, overlap, boxes)
+
+
+def _get_refine_pipeline():
+    """img2img pipeline for the tile pass; it must accept `strength`.
+
+    编辑类 pipeline 没有 `strength`，且会把一批 crop 当作多张参考图，
+    无法做低强度分块重绘，因此不作为回退。
+    """
+    pipe = get_img2img_pipeline()
+    try:
+        params = inspect.signature(pipe.__call__).parameters
+    except Exception:
+        params = {}
+    if "strength" not in params:
+        raise RuntimeError(
+            f"{type(pipe).__name__} does not support `strength`; "
+            "hires refinement needs an img2img pipeline (upgrade diffusers per README)."
+        )
+    return pipe
+
+
+def hires_image(
+    prompt: str,
+    negative_prompt: Optional[str] = None,
+    height: Optional[int] = None,
+    width: Optional[int] = None,
+    num_inference_steps: Optional[int] = None,
+    guidance_scale: Optional[float] = None,
+    seed: Optional[int] = 42,
+    scale: Optional[float] = None,
+    strength: Optional[float] = None,
+    tile_size: Optional[int] = None,
+    tile_overlap: Optional[int] = None,
+    output_path: Optional[str] = None,
+    memory_profile: Optional[str] = None,
+    step_cache: Optional[float] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    info: Optional[dict] = None,
+) -> Path:
+    """Generate at base resolution, upscale, then refine in overlapping tiles.
+
+    峰值内存只取决于 tile 大小（及 CONFIG.hires_tile_batch），与最终输出尺寸无关。
+    `progress(done_tiles, total_tiles)` 在每批 tile 完成后回调。
+    """
+    plan = plan_tiles(height, width, scale, strength, tile_size, tile_overlap)
+    factor = plan.factor
+    strength_val = plan.strength
+
+    # 先确认可做分块重绘，避免基础图出完才失败
+    pipe = _get_refine_pipeline()
+
+    # 1) 基础分辨率出图（复用 generate_image，临时文件用完即删）
+    base_info: dict = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        base_path = generate_image(
+            prompt=prompt,
+            negative_prompt=negative_prompt,
+            height=height,
+            width=width,
+            num_inference_steps=num_inference_steps,
+            guidance_scale=guidance_scale,
+            seed=seed,
+            output_path=str(Path(tmp) / "base.png"),
+            memory_profile=memory_profile,
+            step_cache=step_cache,
+            info=base_info,
+        )
+        with Image.open(base_path) as img:
+            base = img.convert("RGB")
+
+    # 2) 放大到目标尺寸
+    out_w, out_h = plan.out_w, plan.out_h
+    upscaled = base.resize((out_w, out_h), Image.LANCZOS)
+
+    # 3) 分块低强度重绘
+    tile, tile_w, tile_h, overlap = plan.tile, plan.tile_w, plan.tile_h, plan.overlap
+    boxes = plan.boxes
+    total = len(boxes)
+
+    params = inspect.signature(pipe.__call__).parameters
+
+    steps = int(num_inference_steps or CONFIG.num_inference_steps)
+    cfg = guidance_scale if guidance_scale is not None else CONFIG.guidance_scale
+    profile = resolve_memory_profile(memory_profile, tile_h, tile_w)
+    batch = max(1, int(CONFIG.hires_tile_batch))
+
+    print(
+        f"Hires refine: {base.width}x{base.height} -> {out_w}x{out_h}, "
+        f"tiles={total} ({tile_w}x{tile_h}, overlap={overlap}, batch={batch}), "
+        f"strength={strength_val}, memory={profile}",
+        flush=True,
+    )
+
+    acc = np.zeros((out_h, out_w, 3), dtype=np.float32)
+    weight = np.zeros((out_h, out_w, 1), dtype=np.float32)
+
+    if progress is not None:
+        progress(0, total)
+
+    for start in range(0, total, batch):
+        chunk = boxes[start:start + batch]
+        crops = [upscaled.crop(b) for b in chunk]
+        n = len(chunk)
+
+        # 同尺寸 tile 一次送入 pipeline，VAE 编码/文本编码都按批进行。
+        kwargs = {
+            "prompt": [prompt] * n,
+            "image": crops,
+            "height": tile_h,
+            "width": tile_w,
+            "num_inference_steps": steps,
+            "strength": strength_val,
+        }
+        if negative_prompt and "negative_prompt" in params:
+            kwargs["negative_prompt"] = [negative_prompt] * n
+        if "guidance_scale" in params:
+            kwargs["guidance_scale"] = cfg
+
+        def _run():
+            generators = [
+                torch.Generator(device=CONFIG.device).manual_seed(int(seed or 0) + start + i)
+                for i in range(n)
+            ]
+            with torch.inference_mode():
+                return pipe(**kwargs, generator=generators)
+
+        result, profile = run_with_memory_profile(pipe, profile, _run)
+
+        for (x0, y0, x1, y1), refined in zip(chunk, result.images):
+            if refined.size != (tile_w, tile_h):
+                refined = refined.resize((tile_w, tile_h), Image.LANCZOS)
+            mask = _feather_mask(
+                tile_w,
+                tile_h,
+                overlap,
+                left=x0 > 0,
+                top=y0 > 0,
+                right=x1 < out_w,
+                bottom=y1 < out_h,
+            )
+            acc[y0:y1, x0:x1] += np.asarray(refined, dtype=np.float32) * mask
+            weight[y0:y1, x0:x1] += mask
+
+        if progress is not None:
+            progress(min(start + n, total), total)
+
+    image = Image.fromarray(np.clip(acc / np.maximum(weight, 1e-6), 0, 255).astype(np.uint8))
+
+    if info is not None:
+        info["memory_profile"] = base_info.get("memory_profile", profile)
+        info["tile_memory_profile"] = profile
+        info["tiles"] = total
+        if "step_cache" in base_info:
+            info["step_cache"] = base_info["step_cache"]
+
+    if output_path is None:
+        ts = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        output_path = f"assets/hires_{ts}.png"
+
+    metadata = PngImagePlugin.PngInfo()
+    metadata.add_text("mode", "hires")
+    metadata.add_text("prompt", str(prompt))
+    if negative_prompt:
+        metadata.add_text("negative_prompt", str(negative_prompt))
+    metadata.add_text("height", str(out_h))
+    metadata.add_text("width", str(out_w))
+    metadata.add_text("base_height", str(base.height))
+    metadata.add_text("base_width", str(base.width))
+    metadata.add_text("steps", str(steps))
+    metadata.add_text("scale", str(cfg))
+    metadata.add_text("hires_scale", str(factor))
+    metadata.add_text("strength", str(strength_val))
+    metadata.add_text("tile_size", str(tile))
+    metadata.add_text("tile_overlap", str(overlap))
+    if seed is not None:
+        metadata.add_text("seed", str(seed))
+    metadata.add_text("memory_profile", profile)
+
+    path = Path(output_path)
+    if not path.is_absolute():
+        path.parent.mkdir(parents=True, exist_ok=True)
+    image.save(path, pnginfo=metadata)
+    return path
@@ -0,0 +1,148 @@
+"""Content-addressed cache for edit inputs (preprocessed image + VAE encodings).
+
+同一张图片常被反复编辑（换 prompt / strength），每次都要重新解码、缩放、再经 VAE
+编码。这里按「图片字节 sha256 + 目标尺寸参数 + 模型」缓存：
+
+- 预处理后的 PIL 图片及其缩放信息
+- pipeline 调用 `vae.encode()` 的输出（编码结果只取决于输入张量，可安全复用；
+  autocast 降精度运行时不写入缓存）
+
+视觉编码器（Qwen2.5-VL）的输出与 prompt 一起计算，依赖 prompt，因此不做缓存。
+总占用受 CONFIG.input_cache_max_mb 限制，超出时按 LRU 淘汰。
+"""
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from PIL import Image
+import torch
+
+from .config import CONFIG
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _nbytes(obj: Any) -> int:
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, Image.Image):
+        return obj.width * obj.height * len(obj.getbands())
+    if isinstance(obj, (list, tuple)):
+        return sum(_nbytes(o) for o in obj)
+    if isinstance(obj, dict):
+        return sum(_nbytes(o) for o in obj.values())
+    dist = getattr(obj, "latent_dist", None)
+    if dist is not None:
+        return _nbytes(getattr(dist, "parameters", None))
+    return 0
+
+
+class InputEntry:
+    def __init__(self, image: Image.Image, resize_info: dict) -> None:
+        self.image = image
+        self.resize_info = resize_info
+        # (shape, dtype) of the encoded tensor -> vae.encode() output
+        self.encodings: Dict[Tuple, Any] = {}
+
+    def nbytes(self) -> int:
+        return _nbytes(self.image) + sum(_nbytes(v) for v in self.encodings.values())
+
+
+class InputCache:
+    """Thread-safe LRU of InputEntry objects bounded by total bytes."""
+
+    def __init__(self) -> None:
+        self._entries: "OrderedDict[str, InputEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[InputEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: str, entry: InputEntry) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+        self.trim()
+
+    def trim(self) -> None:
+        limit = int(CONFIG.input_cache_max_mb * 1024 * 1024)
+        with self._lock:
+            total = sum(e.nbytes() for e in self._entries.values())
+            while self._entries and total > limit:
+                _, evicted = self._entries.popitem(last=False)
+                total -= evicted.nbytes()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(e.nbytes() for e in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+INPUT_CACHE = InputCache()
+
+
+def cache_key(digest: str, *, width, height, max_side, model_id: str) -> str:
+    return f"{digest}:{width}x{height}:{max_side}:{model_id}"
+
+
+def _autocast_active() -> bool:
+    try:
+        return torch.is_autocast_enabled(CONFIG.device)
+    except (TypeError, RuntimeError):
+        # 旧版 torch 不接受 device_type 参数
+        return torch.is_autocast_enabled() or torch.is_autocast_cpu_enabled()
+
+
+@contextlib.contextmanager
+def reuse_vae_encodings(pipe, entry: Optional[InputEntry]) -> Iterator[None]:
+    """Serve `pipe.vae.encode()` from `entry` during one pipeline call."""
+    vae = getattr(pipe, "vae", None)
+    if entry is None or vae is None or CONFIG.input_cache_max_mb <= 0:
+        yield
+        return
+
+    original = vae.encode
+    had_instance_encode = "encode" in vae.__dict__
+
+    def _encode(x, *args, **kwargs):
+        if not isinstance(x, torch.Tensor):
+            return original(x, *args, **kwargs)
+        key = (tuple(x.shape), str(x.dtype))
+        cached = entry.encodings.get(key)
+        if cached is not None:
+            return cached
+        result = original(x, *args, **kwargs)
+        # autocast 下的编码是降精度结果（可能含 NaN/Inf），只用不存，
+        # 以免 float32 回退重跑及之后的编辑复用它。
+        if not _autocast_active():
+            entry.encodings[key] = result
+        return result
+
+    vae.encode = _encode
+    try:
+        yield
+    finally:
+        if had_instance_encode:
+            vae.encode = original
+        else:
+            del vae.encode
+        INPUT_CACHE.trim()
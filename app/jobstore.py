@@ -0,0 +1,93 @@
+"""Durable job records so queued / running jobs survive restarts.
+
+每个任务在提交时写入 `<job_store_dir>/<job_id>.json`（原子替换），状态变化时更新：
+
+    {"status": {...JobStatus...}, "request": {...}, "admission": [client, cost, bytes]}
+
+启动时 `load()` 读回全部记录：已结束的任务用于继续响应轮询，未结束的
+（queued / processing）由服务端重新入队。已结束记录超过 job_record_ttl_hours 后清除
+（启动时以及运行期间由 `prune()` 周期清除）。
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .config import CONFIG
+
+
+FINISHED = ("completed", "failed")
+
+
+class JobStore:
+    def __init__(self, directory: Path) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.json"
+
+    def save(self, status: dict, request: Optional[dict] = None, admission: Optional[list] = None) -> None:
+        """Write (or update) one job record; `request` / `admission` are kept if omitted."""
+        path = self._path(status["job_id"])
+        with self._lock:
+            record = {}
+            if request is None or admission is None:
+                try:
+                    record = json.loads(path.read_text(encoding="utf-8"))
+                except Exception:
+                    record = {}
+            record["status"] = status
+            if request is not None:
+                record["request"] = request
+            if admission is not None:
+                record["admission"] = admission
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(record, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, path)
+
+    def delete(self, job_id: str) -> None:
+        with self._lock:
+            try:
+                self._path(job_id).unlink()
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _expired(status: dict, now: float) -> bool:
+        ttl = CONFIG.job_record_ttl_hours * 3600
+        return status.get("status") in FINISHED and ttl > 0 and now - status.get("created_at", now) > ttl
+
+    def load(self) -> List[dict]:
+        """All records sorted by creation time; expired finished records are pruned."""
+        now = time.time()
+        records = []
+        for path in self.directory.glob("*.json"):
+            try:
+                record = json.loads(path.read_text(encoding="utf-8"))
+                status = record["status"]
+            except Exception as e:
+                print(f"[jobs] skipping unreadable record {path.name}: {e}", flush=True)
+                continue
+            if self._expired(status, now):
+                self.delete(path.stem)
+                continue
+            records.append(record)
+        records.sort(key=lambda r: r["status"].get("created_at", 0))
+        return records
+
+    def prune(self, finished: Dict[str, dict]) -> List[str]:
+        """Delete expired records among `finished` (job_id -> status); returns their ids.
+
+        运行期间由服务端周期调用，只检查内存中已结束的任务，无需扫描整个目录。
+        """
+        now = time.time()
+        expired = [job_id for job_id, status in finished.items() if self._expired(status, now)]
+        for job_id in expired:
+            self.delete(job_id)
+        return expired
@@ -1,6 +1,17 @@
-from typing import Optional
+import importlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple, TypeVar
 
 import torch
+
+# 离线模式需在 huggingface_hub 导入前设置（其常量在导入时读取）
+if os.getenv("ZIMAGE_OFFLINE", "0") == "1":
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
 from diffusers import ZImagePipeline
 
 # -------- img2img (legacy / sometimes renamed) --------
@@ -27,19 +38,148 @@ try:
 except Exception:  # pragma: no cover
     QwenImageEditPipeline = None  # type: ignore[assignment]
 
-from .config import CONFIG
+from .config import CONFIG, MEMORY_PROFILES, QUANTIZE_MODES
+
 
+_T = TypeVar("_T")
 
 _PIPELINE: Optional[ZImagePipeline] = None
 _PIPELINE_IMG2IMG: Optional[object] = None
 _PIPELINE_EDIT: Optional[object] = None
 
+# 仅对权重最大的两个组件做 weight-only 量化；VAE 体积小且对精度敏感，保持原样。
+_QUANTIZED_COMPONENTS = ("transformer", "text_encoder")
+
+# 快照目录内的标记文件：最后写入，存在即表示快照完整可用。
+SNAPSHOT_MARKER = "zimage_snapshot.json"
+
+# model_id -> 最近一次加载的耗时 / 读取字节数，见 load_stats()
+_LOAD_STATS: Dict[str, dict] = {}
+
+
+def _safe_model_id(model_id: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "--", model_id)
+
+
+def _dtype_name(dtype: torch.dtype) -> str:
+    return str(dtype).replace("torch.", "")
+
+
+def edit_dtype() -> torch.dtype:
+    """dtype used for the edit model (shared by the factory and `app.prepare_model`)."""
+    # Qwen Image Edit 在 MPS 上用 bfloat16 往往更省内存/更快；
+    # 生成（Z-Image-Turbo）仍保持 CONFIG.torch_dtype 的保守策略。
+    return torch.bfloat16 if CONFIG.device == "mps" else CONFIG.torch_dtype
+
+
+def snapshot_path(model_id: str, dtype: torch.dtype) -> Path:
+    return Path(CONFIG.snapshot_dir) / _safe_model_id(model_id) / _dtype_name(dtype)
+
+
+def find_snapshot(model_id: str, dtype: torch.dtype) -> Optional[Path]:
+    """Local pre-converted snapshot for (model_id, dtype), or None if not prepared."""
+    path = snapshot_path(model_id, dtype)
+    return path if (path / SNAPSHOT_MARKER).exists() else None
+
+
+def _weights_bytes(root: Path, skip: Tuple[str, ...] = ()) -> int:
+    """Total size of the safetensors files under `root`, excluding `skip` components."""
+    total = 0
+    for f in root.rglob("*.safetensors"):
+        if f.relative_to(root).parts[0] not in skip:
+            total += f.stat().st_size
+    return total
+
+
+def load_stats() -> Dict[str, dict]:
+    """Weight-loading time / bytes read for each model loaded in this process."""
+    return {k: dict(v) for k, v in _LOAD_STATS.items()}
+
+
+def _load_pipeline(cls, model_id: str, dtype: torch.dtype, quantize: Optional[str]):
+    """from_pretrained + optional weight-only quantization (shared by all factories).
+
+    若存在本地快照（见 `app.prepare_model`）则优先从快照加载：权重已是目标 dtype 的
+    safetensors，按 mmap 方式读取且无需转换，全程不访问 Hub。
+    """
+    if quantize and quantize not in QUANTIZE_MODES:
+        raise ValueError(
+            f"Unknown quantize mode: {quantize!r}. Expected one of {', '.join(QUANTIZE_MODES)}."
+        )
+
+    cached: Dict[str, torch.nn.Module] = {}
+    if quantize:
+        for name in _QUANTIZED_COMPONENTS:
+            module = _load_quantized_component(model_id, dtype, name, quantize)
+            if module is not None:
+                cached[name] = module
+
+    snapshot = find_snapshot(model_id, dtype)
+    if snapshot is None and CONFIG.offline:
+        print(
+            f"[load] no local snapshot for {model_id} ({_dtype_name(dtype)}); "
+            "offline mode, using the local Hugging Face cache only",
+            flush=True,
+        )
+
+    # 已缓存的量化组件直接传入，from_pretrained 不会再加载其原始权重。
+    t0 = time.perf_counter()
+    if snapshot is not None:
+        pipe = cls.from_pretrained(
+            str(snapshot),
+            low_cpu_mem_usage=True,
+            torch_dtype=dtype,
+            use_safetensors=True,
+            local_files_only=True,
+            **cached,
+        )
+    else:
+        pipe = cls.from_pretrained(
+            model_id,
+            low_cpu_mem_usage=True,
+            torch_dtype=dtype,
+            local_files_only=CONFIG.offline,
+            **cached,
+        )
+    load_s = time.perf_counter() - t0
+
+    bytes_read = _weights_bytes(snapshot, tuple(cached)) if snapshot is not None else None
+    _LOAD_STATS[model_id] = {
+        "source": str(snapshot) if snapshot is not None else "hub",
+        "dtype": _dtype_name(dtype),
+        "load_s": round(load_s, 2),
+        "bytes_read": bytes_read,
+    }
+    if bytes_read is not None:
+        mb = bytes_read / float(1024 ** 2)
+        print(
+            f"[load] {model_id}: {mb:.0f} MB from snapshot {snapshot} in {load_s:.1f}s "
+            f"({mb / max(load_s, 1e-6):.0f} MB/s)",
+            flush=True,
+        )
+    else:
+        print(f"[load] {model_id}: loaded from hub cache in {load_s:.1f}s", flush=True)
+
+    if quantize:
+        for name in _QUANTIZED_COMPONENTS:
+            if name in cached:
+                continue
+            module = getattr(pipe, name, None)
+            if module is None:
+                continue
+            _quantize_component(module, quantize)
+            _save_quantized_component(module, model_id, dtype, name, quantize)
+        print(f"[quantize] {model_id}: {quantize} weights for {', '.join(_QUANTIZED_COMPONENTS)}", flush=True)
+
+    return pipe.to(CONFIG.device)
+
 
 def get_pipeline() -> ZImagePipeline:
     """Lazily create and cache a global ZImagePipeline instance.
 
-    The weights will be downloaded from the Hugging Face Hub on first use
-    and then kept in memory for subsequent calls.
+    The weights are read from the local snapshot when one was prepared
+    (`python -m app.prepare_model`), otherwise downloaded from the Hugging
+    Face Hub on first use; they are then kept in memory for subsequent calls.
     """
     global _PIPELINE
     if _PIPELINE is not None:
@@ -48,13 +188,7 @@ def get_pipeline() -> ZImagePipeline:
     # Note: diffusers >=0.33 推荐使用 `dtype` 参数，而不是 `torch_dtype`。
     # 同时，为了兼容 MPS / CPU，默认关闭 torch.compile，避免出现数值不稳定
     #（NaN 导致导出图片为黑图）的情况。
-    pipe = ZImagePipeline.from_pretrained(
-        CONFIG.model_id,
-        low_cpu_mem_usage=True,
-        torch_dtype=CONFIG.torch_dtype,
-    )
-
-    pipe = pipe.to(CONFIG.device)
+    pipe = _load_pipeline(ZImagePipeline, CONFIG.model_id, CONFIG.torch_dtype, CONFIG.quantize)
 
     # 如需在 CUDA 上进一步优化，可以只在 CUDA 场景下手动开启 compile：
     # if CONFIG.device == "cuda" and hasattr(torch, "compile"):
@@ -67,16 +201,17 @@ def get_pipeline() -> ZImagePipeline:
 def get_img2img_pipeline():
     """Lazily create and cache a global img2img pipeline instance.
 
-    说明：diffusers 不同版本里，这个类名可能是：
-    - ZImageImg2ImgPipeline（旧）
-    - QwenImageImg2ImgPipeline（新）
+    与生成 pipeline 共用 Z-Image 权重，因此只能使用 ZImageImg2ImgPipeline。
+    QwenImageImg2ImgPipeline 属于 Qwen-Image 模型族：组件名虽相同，
+    但套用 Z-Image 的 transformer / text encoder 会在调用时出错或出图异常。
     """
 
-    cls = ZImageImg2ImgPipeline or QwenImageImg2ImgPipeline
+    cls = ZImageImg2ImgPipeline
     if cls is None:
+        found = " (only QwenImageImg2ImgPipeline, which cannot use Z-Image weights)" if QwenImageImg2ImgPipeline else ""
         raise RuntimeError(
-            "Img2Img pipeline is not available in your diffusers installation. "
-            "Tried: ZImageImg2ImgPipeline, QwenImageImg2ImgPipeline. "
+            "Img2Img pipeline is not available in your diffusers installation"
+            f"{found}. Tried: ZImageImg2ImgPipeline. "
             "Please upgrade diffusers (installed from source per README)."
         )
 
@@ -84,13 +219,14 @@ def get_img2img_pipeline():
     if _PIPELINE_IMG2IMG is not None:
         return _PIPELINE_IMG2IMG
 
-    pipe = cls.from_pretrained(
-        CONFIG.model_id,
-        low_cpu_mem_usage=True,
-        torch_dtype=CONFIG.torch_dtype,
-    )
-
-    pipe = pipe.to(CONFIG.device)
+    # 与生成 pipeline 共用同一份权重（transformer / text encoder / VAE），
+    # 避免再 from_pretrained 一次导致模型内存翻倍。
+    base = get_pipeline()
+    if hasattr(cls, "from_pipe"):
+        pipe = cls.from_pipe(base)
+    else:
+        pipe = cls(**base.components)
+    _link_shared(base, pipe)
 
     _PIPELINE_IMG2IMG = pipe
     return _PIPELINE_IMG2IMG
@@ -118,17 +254,7 @@ def get_edit_pipeline():
     if _PIPELINE_EDIT is not None:
         return _PIPELINE_EDIT
 
-    # Qwen Image Edit 在 MPS 上用 bfloat16 往往更省内存/更快；
-    # 生成（Z-Image-Turbo）仍保持 CONFIG.torch_dtype 的保守策略。
-    dtype = torch.bfloat16 if CONFIG.device == "mps" else CONFIG.torch_dtype
-
-    pipe = cls.from_pretrained(
-        model_id,
-        low_cpu_mem_usage=True,
-        torch_dtype=dtype,
-    )
-
-    pipe = pipe.to(CONFIG.device)
+    pipe = _load_pipeline(cls, model_id, edit_dtype(), CONFIG.edit_quantize)
 
     # Ensure tqdm progress is visible in server logs.
     try:
@@ -138,3 +264,275 @@ def get_edit_pipeline():
 
     _PIPELINE_EDIT = pipe
     return _PIPELINE_EDIT
+
+
+def reset_pipelines() -> None:
+    """Drop all cached pipelines (e.g. after changing CONFIG in a benchmark)."""
+    global _PIPELINE, _PIPELINE_IMG2IMG, _PIPELINE_EDIT
+    _PIPELINE = None
+    _PIPELINE_IMG2IMG = None
+    _PIPELINE_EDIT = None
+    _empty_device_cache()
+
+
+# -------- weight-only quantization (optimum-quanto) --------
+
+def _require_quanto():
+    try:
+        import optimum.quanto as quanto  # type: ignore
+    except Exception as e:
+        raise RuntimeError(
+            "Quantized loading requires optimum-quanto. "
+            "Install it with: pip install optimum-quanto"
+        ) from e
+    return quanto
+
+
+def _quantized_cache_path(model_id: str, dtype: torch.dtype, component: str, mode: str) -> Path:
+    # 源 dtype 不同，量化结果（及未量化的部分权重）也不同，需分别缓存
+    return Path(CONFIG.quantize_cache_dir) / _safe_model_id(model_id) / _dtype_name(dtype) / f"{component}-{mode}"
+
+
+def _quantize_component(module: torch.nn.Module, mode: str) -> None:
+    quanto = _require_quanto()
+    weights = {"int8": quanto.qint8, "int4": quanto.qint4}[mode]
+    quanto.quantize(module, weights=weights)
+    quanto.freeze(module)
+
+
+def _save_quantized_component(
+    module: torch.nn.Module, model_id: str, dtype: torch.dtype, component: str, mode: str
+) -> None:
+    """Cache a frozen quantized component so the next start skips re-quantizing.
+
+    保存失败只打印日志，不影响本次加载。
+    """
+    quanto = _require_quanto()
+    try:
+        from safetensors.torch import save_file
+
+        base = _quantized_cache_path(model_id, dtype, component, mode)
+        base.mkdir(parents=True, exist_ok=True)
+        config = module.config
+        meta = {
+            "class": f"{type(module).__module__}.{type(module).__qualname__}",
+            "config": config.to_dict() if hasattr(config, "to_dict") else dict(config),
+            "quantization_map": quanto.quantization_map(module),
+        }
+        save_file(module.state_dict(), str(base / "model.safetensors"))
+        (base / "quanto.json").write_text(json.dumps(meta), encoding="utf-8")
+        print(f"[quantize] cached {component} ({mode}) to {base}", flush=True)
+    except Exception as e:
+        print(f"[quantize] failed to cache {component} ({mode}): {e}", flush=True)
+
+
+def _load_quantized_component(
+    model_id: str, dtype: torch.dtype, component: str, mode: str
+) -> Optional[torch.nn.Module]:
+    """Rebuild a cached quantized component without materializing float weights."""
+    base = _quantized_cache_path(model_id, dtype, component, mode)
+    meta_path = base / "quanto.json"
+    weights_path = base / "model.safetensors"
+    if not (meta_path.exists() and weights_path.exists()):
+        return None
+
+    quanto = _require_quanto()
+    try:
+        from accelerate import init_empty_weights
+        from safetensors.torch import load_file
+
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        module_name, _, cls_name = meta["class"].rpartition(".")
+        cls = getattr(importlib.import_module(module_name), cls_name)
+
+        with init_empty_weights():
+            if hasattr(cls, "config_class") and cls.config_class is not None:
+                # transformers.PreTrainedModel
+                module = cls(cls.config_class.from_dict(meta["config"]))
+            else:
+                # diffusers.ModelMixin
+                module = cls.from_config(meta["config"])
+
+        quanto.requantize(module, load_file(str(weights_path)), meta["quantization_map"], device=torch.device("cpu"))
+        module.eval()
+        print(f"[quantize] loaded cached {component} ({mode}) from {base}", flush=True)
+        return module
+    except Exception as e:
+        print(f"[quantize] ignoring cached {component} ({mode}): {e}", flush=True)
+        return None
+
+
+# -------- memory profiles --------
+
+def available_memory_gb() -> Optional[float]:
+    """Best-effort estimate of free memory in GB (None if unknown).
+
+    Apple Silicon 使用统一内存，系统可用内存即可近似 GPU 可用内存。
+    """
+    try:
+        import psutil  # type: ignore
+
+        return psutil.virtual_memory().available / float(1024 ** 3)
+    except Exception:
+        pass
+    try:
+        if CONFIG.device == "mps":
+            free = torch.mps.recommended_max_memory() - torch.mps.driver_allocated_memory()
+            return max(0, free) / float(1024 ** 3)
+    except Exception:
+        pass
+    return None
+
+
+def resolve_memory_profile(
+    profile: Optional[str],
+    height: int,
+    width: int,
+    *,
+    edit: bool = False,
+) -> str:
+    """Resolve "auto" (or None) into a concrete memory profile for one job."""
+    name = profile or CONFIG.memory_profile
+    if name != "auto":
+        if name not in MEMORY_PROFILES:
+            raise ValueError(
+                f"Unknown memory profile: {name!r}. "
+                f"Expected 'auto' or one of {', '.join(MEMORY_PROFILES)}."
+            )
+        return name
+
+    pixels = int(height) * int(width) * (2 if edit else 1)
+    if pixels >= CONFIG.min_mem_pixels:
+        idx = 3
+    elif pixels >= CONFIG.low_mem_pixels:
+        idx = 2
+    elif pixels > CONFIG.balanced_pixels:
+        idx = 1
+    else:
+        idx = 0
+
+    free_gb = available_memory_gb()
+    if free_gb is not None and free_gb < CONFIG.low_memory_gb:
+        idx += 1
+
+    return MEMORY_PROFILES[min(idx, len(MEMORY_PROFILES) - 1)]
+
+
+def _call_optional(obj, name: str, *args, **kwargs) -> bool:
+    fn = getattr(obj, name, None)
+    if fn is None:
+        return False
+    try:
+        fn(*args, **kwargs)
+        return True
+    except Exception as e:
+        print(f"[memory] {type(obj).__name__}.{name} failed: {e}", flush=True)
+        return False
+
+
+def _link_shared(a, b) -> None:
+    """Mark two pipelines as sharing component modules (see apply_memory_profile)."""
+    for x, y in ((a, b), (b, a)):
+        siblings = getattr(x, "_zimage_siblings", [])
+        siblings.append(y)
+        x._zimage_siblings = siblings
+
+
+def apply_memory_profile(pipe, profile: str) -> str:
+    """Switch a cached pipeline to the given memory profile (idempotent).
+
+    各个开关都是 best-effort：某些 pipeline / 组件不支持时会静默跳过。
+    Returns the profile actually in effect (lower than requested if offload failed).
+    """
+    current = getattr(pipe, "_zimage_memory_profile", None)
+    if current == profile:
+        return profile
+    if current is not None and getattr(pipe, "_zimage_requested_profile", None) == profile:
+        # 上次已按该请求应用过（offload 不可用时实际档位较低），无需重复尝试
+        return current
+    pipe._zimage_requested_profile = profile
+
+    # 共用组件的 pipeline：offload hooks 与设备位置挂在共享的模块上，
+    # 切换本 pipeline 前先撤掉对方的 hooks，并让对方下次重新应用档位。
+    for other in getattr(pipe, "_zimage_siblings", []):
+        if getattr(other, "_zimage_memory_profile", None) in ("low_mem", "min_mem"):
+            _call_optional(other, "remove_all_hooks")
+        other._zimage_memory_profile = None
+
+    # 从 offload 档位切回时，需要先移除 accelerate 挂的 hooks 再搬回设备。
+    if current in ("low_mem", "min_mem"):
+        _call_optional(pipe, "remove_all_hooks")
+
+    slicing = profile != "fast"
+    vae = getattr(pipe, "vae", None)
+    if slicing:
+        if not _call_optional(pipe, "enable_vae_tiling") and vae is not None:
+            _call_optional(vae, "enable_tiling")
+        if not _call_optional(pipe, "enable_vae_slicing") and vae is not None:
+            _call_optional(vae, "enable_slicing")
+        _call_optional(pipe, "enable_attention_slicing")
+    else:
+        if not _call_optional(pipe, "disable_vae_tiling") and vae is not None:
+            _call_optional(vae, "disable_tiling")
+        if not _call_optional(pipe, "disable_vae_slicing") and vae is not None:
+            _call_optional(vae, "disable_slicing")
+        _call_optional(pipe, "disable_attention_slicing")
+
+    # offload 失败时退到下一种 offload；都不可用则实际生效的是 "balanced"
+    # （切片 + 模型留在设备上），记录并返回实际档位，而不是请求的档位。
+    applied = profile
+    failed = getattr(pipe, "_zimage_offload_failed", set())
+    if profile == "low_mem":
+        if "low_mem" in failed or not _call_optional(pipe, "enable_model_cpu_offload", device=CONFIG.device):
+            failed.add("low_mem")
+            applied = "min_mem"
+    if applied == "min_mem":
+        if "min_mem" in failed or not _call_optional(pipe, "enable_sequential_cpu_offload", device=CONFIG.device):
+            failed.add("min_mem")
+            applied = "balanced"
+    pipe._zimage_offload_failed = failed
+    if applied != profile:
+        print(f"[memory] profile '{profile}' unavailable for {type(pipe).__name__}; using '{applied}'", flush=True)
+        if applied == "balanced":
+            # 失败的 offload 可能已挂上部分 hooks
+            _call_optional(pipe, "remove_all_hooks")
+    if applied in ("fast", "balanced"):
+        pipe.to(CONFIG.device)
+
+    pipe._zimage_memory_profile = applied
+    return applied
+
+
+def _is_oom_error(exc: BaseException) -> bool:
+    msg = str(exc).lower()
+    return "out of memory" in msg or "mps backend out of memory" in msg
+
+
+def _empty_device_cache() -> None:
+    try:
+        if CONFIG.device == "mps":
+            torch.mps.empty_cache()
+        elif CONFIG.device == "cuda":
+            torch.cuda.empty_cache()
+    except Exception:
+        pass
+
+
+def run_with_memory_profile(pipe, profile: str, call: Callable[[], _T]) -> Tuple[_T, str]:
+    """Run `call()` under `profile`, stepping down to leaner profiles on OOM.
+
+    宁可慢一点也不要让 worker 崩溃：遇到 OOM 时自动切换到下一个更省内存的档位重试。
+    Returns (result, profile actually used).
+    """
+    while True:
+        applied = apply_memory_profile(pipe, profile)
+        try:
+            return call(), applied
+        except RuntimeError as e:
+            idx = MEMORY_PROFILES.index(profile)
+            if not _is_oom_error(e) or idx + 1 >= len(MEMORY_PROFILES):
+                raise
+            nxt = MEMORY_PROFILES[idx + 1]
+            print(f"[memory] OOM with profile '{profile}', retrying with '{nxt}'", flush=True)
+            _empty_device_cache()
+            profile = nxt
@@ -0,0 +1,213 @@
+"""Adaptive precision: try the fast path, fall back to float32 on NaN/Inf.
+
+config.py 默认强制 float32，是因为 MPS 上的 float16 偶尔会产生 NaN / 黑图。
+在 CONFIG.precision == "adaptive" 时，任务先以 autocast 降精度（和/或编译后的
+transformer）运行，并在每步回调检查 latents、在解码后检查图像；任一检查失败就
+用安全的 float32 配置重跑该任务。按分辨率统计回退率，持续失败的配置会被停用。
+"""
+from __future__ import annotations
+
+import contextlib
+import inspect
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+import torch
+
+from .config import CONFIG
+from .pipeline import _is_oom_error, run_with_memory_profile
+
+
+SAFE = "float32"
+
+
+class NumericalInstabilityError(RuntimeError):
+    """Raised when latents or decoded pixels contain NaN/Inf."""
+
+
+_STATS_LOCK = threading.Lock()
+# (kind, fast config name, "WxH") -> {"runs": n, "fallbacks": n}
+_STATS: Dict[Tuple[str, str, str], Dict[str, int]] = {}
+
+
+def _record(key: Tuple[str, str, str], failed: bool, error: Optional[str] = None) -> None:
+    """Count one fast-path run; `error` marks the config as unusable (disabled at once)."""
+    with _STATS_LOCK:
+        entry = _STATS.setdefault(key, {"runs": 0, "fallbacks": 0})
+        entry["runs"] += 1
+        if failed:
+            entry["fallbacks"] += 1
+        if error is not None:
+            entry["error"] = error
+
+
+def _is_disabled(key: Tuple[str, str, str]) -> bool:
+    with _STATS_LOCK:
+        entry = _STATS.get(key)
+    if entry and "error" in entry:
+        return True
+    if not entry or entry["runs"] < CONFIG.precision_min_runs:
+        return False
+    return entry["fallbacks"] / entry["runs"] >= CONFIG.precision_max_fallback_rate
+
+
+def precision_stats() -> List[dict]:
+    """Per-resolution fallback rates of the fast configurations."""
+    with _STATS_LOCK:
+        items = sorted(_STATS.items())
+    out = []
+    for (kind, name, size), entry in items:
+        rate = entry["fallbacks"] / entry["runs"] if entry["runs"] else 0.0
+        out.append(
+            {
+                "kind": kind,
+                "config": name,
+                "size": size,
+                "runs": entry["runs"],
+                "fallbacks": entry["fallbacks"],
+                "fallback_rate": rate,
+                "disabled": _is_disabled((kind, name, size)),
+                "error": entry.get("error"),
+            }
+        )
+    return out
+
+
+# (device, dtype) -> None if autocast works there, else the error message
+_AUTOCAST_SUPPORT: Dict[Tuple[str, str], Optional[str]] = {}
+
+
+def _autocast_error(dtype: torch.dtype) -> Optional[str]:
+    """Probe once whether autocast to `dtype` works on CONFIG.device."""
+    key = (CONFIG.device, str(dtype))
+    if key not in _AUTOCAST_SUPPORT:
+        try:
+            with torch.autocast(device_type=CONFIG.device, dtype=dtype):
+                x = torch.ones(8, 8, device=CONFIG.device)
+                (x @ x).sum().item()
+            _AUTOCAST_SUPPORT[key] = None
+        except Exception as e:
+            _AUTOCAST_SUPPORT[key] = f"{type(e).__name__}: {e}"
+            print(f"[precision] autocast to {dtype} unsupported on {CONFIG.device}: {e}", flush=True)
+    return _AUTOCAST_SUPPORT[key]
+
+
+def _fast_config(pipe) -> Optional[Tuple[Optional[torch.dtype], bool]]:
+    """(autocast dtype or None, compile transformer?) — None if there is no fast path."""
+    autocast = CONFIG.fast_dtype
+    # 权重本身已是低精度（如 MPS 上的 Qwen Edit 用 bfloat16）时不再 autocast。
+    if autocast is not None and getattr(pipe, "dtype", torch.float32) != torch.float32:
+        autocast = None
+    if autocast is not None and _autocast_error(autocast) is not None:
+        autocast = None
+    compile_ = bool(CONFIG.fast_compile) and hasattr(torch, "compile") and hasattr(pipe, "transformer")
+    if autocast is None and not compile_:
+        return None
+    return autocast, compile_
+
+
+def _config_name(autocast: Optional[torch.dtype], compile_: bool) -> str:
+    parts = []
+    if autocast is not None:
+        parts.append(f"autocast-{str(autocast).replace('torch.', '')}")
+    if compile_:
+        parts.append("compile")
+    return "+".join(parts)
+
+
+@contextlib.contextmanager
+def _fast_path(pipe, autocast: Optional[torch.dtype], compile_: bool) -> Iterator[None]:
+    original = getattr(pipe, "transformer", None)
+    if compile_:
+        compiled = getattr(pipe, "_zimage_compiled_transformer", None)
+        if compiled is None:
+            compiled = torch.compile(original)
+            pipe._zimage_compiled_transformer = compiled
+        pipe.transformer = compiled
+    try:
+        ctx = torch.autocast(device_type=CONFIG.device, dtype=autocast) if autocast is not None else contextlib.nullcontext()
+        with ctx:
+            yield
+    finally:
+        if compile_:
+            pipe.transformer = original
+
+
+def _sentinel_kwargs(pipe) -> dict:
+    """Extra pipeline kwargs: NaN check on latents each step + numpy output."""
+    params: Dict[str, Any] = {}
+    try:
+        params = dict(inspect.signature(pipe.__call__).parameters)
+    except Exception:
+        pass
+
+    kwargs: dict = {"output_type": "np"}
+    if "callback_on_step_end" in params:
+        def _check_latents(_pipe, step, _timestep, callback_kwargs):
+            latents = callback_kwargs.get("latents")
+            if latents is not None and not bool(torch.isfinite(latents).all()):
+                raise NumericalInstabilityError(f"non-finite latents at step {step}")
+            return callback_kwargs
+
+        kwargs["callback_on_step_end"] = _check_latents
+        kwargs["callback_on_step_end_tensor_inputs"] = ["latents"]
+    return kwargs
+
+
+def _to_checked_pil(images) -> List[Image.Image]:
+    arr = np.asarray(images)
+    if not np.isfinite(arr).all():
+        raise NumericalInstabilityError("non-finite pixels in decoded image")
+    arr = (np.clip(arr, 0.0, 1.0) * 255).round().astype(np.uint8)
+    return [Image.fromarray(a) for a in arr]
+
+
+def run_with_precision(
+    pipe,
+    kind: str,
+    profile: str,
+    height: int,
+    width: int,
+    call: Callable[[dict], Any],
+) -> Tuple[List[Image.Image], str, str]:
+    """Run `call(extra_kwargs)` with adaptive precision and memory fallback.
+
+    `call` must forward `extra_kwargs` to the pipeline. Returns
+    (images, memory profile used, precision used).
+    """
+    fast = _fast_config(pipe) if CONFIG.precision == "adaptive" else None
+    fast_error: Optional[str] = None
+    if fast is not None:
+        name = _config_name(*fast)
+        key = (kind, name, f"{width}x{height}")
+        if not _is_disabled(key):
+            try:
+                with _fast_path(pipe, *fast):
+                    result, profile = run_with_memory_profile(
+                        pipe, profile, lambda: call(_sentinel_kwargs(pipe))
+                    )
+                    images = _to_checked_pil(result.images)
+                _record(key, failed=False)
+                return images, profile, name
+            except NumericalInstabilityError as e:
+                _record(key, failed=True)
+                print(f"[precision] {name} failed ({e}); rerunning in {SAFE}", flush=True)
+                if _is_disabled(key):
+                    print(f"[precision] disabling {name} for {kind} at {width}x{height}", flush=True)
+            except Exception as e:
+                # 可能是编译失败等快速路径自身的问题，也可能是与精度无关的错误
+                # （参数错误等）。先以 float32 重跑：只有重跑成功才说明是快速路径
+                # 的问题，才停用该配置；重跑也失败则照常抛出，不影响统计。
+                # OOM 已由内存档位处理，照常抛出。
+                if _is_oom_error(e):
+                    raise
+                fast_error = f"{type(e).__name__}: {e}"
+                print(f"[precision] {name} raised ({fast_error}); rerunning in {SAFE}", flush=True)
+
+    result, profile = run_with_memory_profile(pipe, profile, lambda: call({}))
+    if fast_error is not None:
+        _record(key, failed=True, error=fast_error)
+        print(f"[precision] disabling {name} for {kind} at {width}x{height}", flush=True)
+    return list(result.images), profile, SAFE
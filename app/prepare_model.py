@@ -0,0 +1,104 @@
+"""Save local, pre-converted model snapshots for fast (and offline) cold starts.
+
+用法：
+    python -m app.prepare_model               # 生成 + 编辑模型
+    python -m app.prepare_model --models generate --force
+
+每个模型按服务端实际使用的 dtype（生成：CONFIG.torch_dtype；编辑：MPS 上为 bfloat16）
+加载一次，再以 safetensors 保存到 `<snapshot_dir>/<model_id>/<dtype>/`。之后
+pipeline 工厂会直接从该目录 mmap 加载，不访问 Hub，也不再做 dtype 转换；
+配合 ZIMAGE_OFFLINE=1 可确保启动时完全不联网。
+"""
+import argparse
+import json
+import shutil
+import time
+from pathlib import Path
+
+import torch
+
+from .config import CONFIG
+from .pipeline import (
+    SNAPSHOT_MARKER,
+    QwenImageEditPipeline,
+    QwenImageEditPlusPipeline,
+    ZImagePipeline,
+    _dtype_name,
+    _weights_bytes,
+    edit_dtype,
+    find_snapshot,
+    snapshot_path,
+)
+
+
+def save_snapshot(cls, model_id: str, dtype: torch.dtype, force: bool = False) -> Path:
+    """Convert `model_id` to `dtype` and save it as a local safetensors snapshot."""
+    existing = find_snapshot(model_id, dtype)
+    if existing is not None and not force:
+        print(f"[prepare] {model_id} ({_dtype_name(dtype)}): snapshot exists at {existing}", flush=True)
+        return existing
+
+    target = snapshot_path(model_id, dtype)
+    tmp = target.with_name(target.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    t0 = time.perf_counter()
+    pipe = cls.from_pretrained(
+        model_id,
+        low_cpu_mem_usage=True,
+        torch_dtype=dtype,
+        local_files_only=CONFIG.offline,
+    )
+    pipe.save_pretrained(str(tmp), safe_serialization=True)
+    del pipe
+
+    size = _weights_bytes(tmp)
+    meta = {
+        "model_id": model_id,
+        "pipeline": cls.__name__,
+        "dtype": _dtype_name(dtype),
+        "device": CONFIG.device,
+        "weights_bytes": size,
+        "created_at": time.time(),
+    }
+    # 标记文件最后写入：中途失败的快照不会被加载
+    (tmp / SNAPSHOT_MARKER).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    shutil.rmtree(target, ignore_errors=True)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp.rename(target)
+
+    print(
+        f"[prepare] {model_id} ({_dtype_name(dtype)}): {size / float(1024 ** 3):.2f} GB "
+        f"saved to {target} in {time.perf_counter() - t0:.1f}s",
+        flush=True,
+    )
+    return target
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prepare local pre-converted model snapshots.")
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=["generate", "edit"],
+        choices=["generate", "edit"],
+        help="Which models to prepare.",
+    )
+    parser.add_argument("--force", action="store_true", help="Rebuild snapshots that already exist.")
+    args = parser.parse_args()
+
+    if "generate" in args.models:
+        save_snapshot(ZImagePipeline, CONFIG.model_id, CONFIG.torch_dtype, force=args.force)
+
+    if "edit" in args.models:
+        cls = QwenImageEditPlusPipeline or QwenImageEditPipeline
+        if cls is None or not CONFIG.edit_model_id:
+            print("[prepare] edit pipeline not available; skipping edit model", flush=True)
+        else:
+            save_snapshot(cls, CONFIG.edit_model_id, edit_dtype(), force=args.force)
+
+    print(f"\nSnapshots in {Path(CONFIG.snapshot_dir).resolve()}; set ZIMAGE_OFFLINE=1 to start without network.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,19 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, Response
 from pydantic import BaseModel
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
 from pathlib import Path
-from PIL import Image
+import asyncio
+import gzip
+import hashlib
+import json
 import os
 import sys
 import traceback
 import queue
+import re
 import threading
 import uuid
 import time
@@ -25,8 +30,18 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 os.chdir(PROJECT_ROOT)
 sys.path.append(str(PROJECT_ROOT))
 
+from app.config import CONFIG, MEMORY_PROFILES
 from app.generate import generate_image
 from app.edit import edit_image
+from app.hires import hires_image, plan_tiles
+from app.variations import generate_variations
+from app.pipeline import load_stats
+from app.precision import precision_stats
+from app.input_cache import INPUT_CACHE, hash_bytes
+from app.admission import ADMISSION, Rejected, estimate_cost
+from app.assets import AssetFiles, etag_matches, forget, read_metadata, version_token
+from app.storage import StorageManager
+from app.jobstore import JobStore
 
 app = FastAPI()
 
@@ -43,12 +58,17 @@ app.add_middleware(
 # Ensure assets directory exists
 ASSETS_DIR = PROJECT_ROOT / "assets"
 ASSETS_DIR.mkdir(parents=True, exist_ok=True)
-app.mount("/assets", StaticFiles(directory=str(ASSETS_DIR)), name="assets")
 
 # Temporary input images for edit jobs (not mounted)
 INPUT_DIR = PROJECT_ROOT / ".zimage_inputs"
 INPUT_DIR.mkdir(parents=True, exist_ok=True)
 
+# Quota / age based cleanup of assets and orphaned inputs (runs in background)
+STORAGE = StorageManager(ASSETS_DIR, INPUT_DIR, PROJECT_ROOT / CONFIG.pins_file)
+STORAGE.on_asset_removed = forget
+
+app.mount("/assets", AssetFiles(directory=str(ASSETS_DIR), on_access=STORAGE.touch), name="assets")
+
 class GenerateRequest(BaseModel):
     prompt: str
     negative_prompt: Optional[str] = None
@@ -57,6 +77,22 @@ class GenerateRequest(BaseModel):
     steps: Optional[int] = 9
     guidance: Optional[float] = 0.0
     seed: Optional[int] = 42
+    # None / "auto" 表示按分辨率与可用内存自动选择
+    memory_profile: Optional[str] = None
+    # 步间缓存阈值（0 关闭，越大越快）；None 使用服务端默认
+    step_cache: Optional[float] = None
+
+class HiresRequest(GenerateRequest):
+    # None 表示使用 CONFIG 中的 hires_* 默认值
+    scale: Optional[float] = None
+    strength: Optional[float] = None
+    tile_size: Optional[int] = None
+    tile_overlap: Optional[int] = None
+
+class VariationsRequest(GenerateRequest):
+    # 显式给出 seeds 时忽略 count；否则生成 count 个随机 seed
+    count: Optional[int] = 4
+    seeds: Optional[List[int]] = None
 
 class OptimizeRequest(BaseModel):
     prompt: str
@@ -73,30 +109,119 @@ class EditJobRequest(BaseModel):
     steps: Optional[int] = 25
     guidance: Optional[float] = 1.0
     seed: Optional[int] = 42
+    memory_profile: Optional[str] = None
+    step_cache: Optional[float] = None
     input_path: str
+    # 通过 /api/inputs 上传的内容寻址图片会被复用，任务结束后不删除
+    cleanup_input: bool = True
 
 
 class JobStatus(BaseModel):
     job_id: str
-    job_type: str  # "generate" | "edit"
+    job_type: str  # "generate" | "edit" | "hires" | "variations"
     status: str  # "queued", "processing", "completed", "failed"
     position: Optional[int] = None
+    progress: Optional[Dict] = None
     result: Optional[Dict] = None
     error: Optional[str] = None
     created_at: float
     prompt: str
 
+def _validate_memory_profile(profile: Optional[str]) -> None:
+    if profile and profile != "auto" and profile not in MEMORY_PROFILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid memory_profile. Expected 'auto' or one of {', '.join(MEMORY_PROFILES)}.",
+        )
+
 # Global Queue and Results
 job_queue = queue.Queue()
 job_results: Dict[str, JobStatus] = {}
 current_job_id: Optional[str] = None
+# job_id -> (client, cost, upload bytes) reserved in ADMISSION; released by the worker
+job_admission: Dict[str, Tuple[str, float, int]] = {}
+# job_id -> resolved input path of unfinished edit jobs (kept safe from storage GC)
+job_inputs: Dict[str, str] = {}
+STORAGE.live_inputs = lambda: set(job_inputs.values())
+STORAGE.on_input_removed = ADMISSION.release_upload
+
+# Jobs are persisted at submit time and requeued on restart
+JOB_STORE = JobStore(PROJECT_ROOT / CONFIG.job_store_dir)
+# Set on SIGTERM: stop admitting jobs and stop picking up new ones
+draining = threading.Event()
+
+
+def _client_of(request: Request) -> str:
+    return ADMISSION.client_key(
+        request.headers.get("x-api-key"),
+        request.client.host if request.client else None,
+    )
+
+
+def _raise_rejected(r: Rejected) -> None:
+    print(f"Rejected job ({r.reason}): {r.detail}", flush=True)
+    raise HTTPException(
+        status_code=r.status_code,
+        detail=r.detail,
+        headers={"Retry-After": str(r.retry_after)},
+    )
+
+
+def _admit(request: Request, job_id: str, cost: float, upload_bytes: int = 0) -> None:
+    """Reserve queue capacity for a job or respond 429 with Retry-After."""
+    if draining.is_set():
+        raise HTTPException(
+            status_code=503,
+            detail="Server is shutting down; retry shortly.",
+            headers={"Retry-After": str(int(CONFIG.shutdown_timeout_s))},
+        )
+    client = _client_of(request)
+    try:
+        ADMISSION.admit(client, cost, upload_bytes)
+    except Rejected as r:
+        _raise_rejected(r)
+    job_admission[job_id] = (client, cost, upload_bytes)
+
+
+def _release(job_id: str) -> float:
+    """Give back a job's reserved capacity; returns its estimated cost."""
+    client, cost, upload_bytes = job_admission.pop(job_id, ("", 0.0, 0))
+    ADMISSION.release(client, cost, upload_bytes)
+    return cost
+
+
+def _enqueue(job_status: JobStatus, req: BaseModel) -> None:
+    """Register, persist and queue a job (persisting first so a crash cannot lose it)."""
+    job_id = job_status.job_id
+    job_results[job_id] = job_status
+    admission = list(job_admission.get(job_id, ("", 0.0, 0)))
+    JOB_STORE.save(job_status.model_dump(), req.model_dump(), admission)
+    job_queue.put((job_id, job_status.job_type, req))
+
+
+def _persist(job_id: str) -> None:
+    if job_id in job_results:
+        try:
+            JOB_STORE.save(job_results[job_id].model_dump())
+        except Exception as e:
+            print(f"Error persisting job {job_id}: {e}", flush=True)
 
 def worker():
     global current_job_id
     print("Worker thread started", flush=True)
     while True:
         try:
-            job_id, job_type, req = job_queue.get()
+            if draining.is_set():
+                time.sleep(0.5)
+                continue
+            try:
+                job_id, job_type, req = job_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if draining.is_set():
+                # 停机中：不再开始新任务，其记录仍为 queued，重启后恢复
+                job_queue.task_done()
+                continue
             current_job_id = job_id
 
             # Update status to processing
@@ -104,9 +229,12 @@ def worker():
                 job_results[job_id].status = "processing"
                 job_results[job_id].position = 0
                 job_results[job_id].job_type = job_type
+                _persist(job_id)
 
             print(f"Processing job {job_id} ({job_type}): {req.prompt}", flush=True)
+            started = time.monotonic()
 
+            info: dict = {}
             try:
                 if job_type == "generate":
                     output_path = generate_image(
@@ -117,6 +245,9 @@ def worker():
                         num_inference_steps=req.steps,
                         guidance_scale=req.guidance,
                         seed=req.seed,
+                        memory_profile=req.memory_profile,
+                        step_cache=req.step_cache,
+                        info=info,
                     )
                 elif job_type == "edit":
                     output_path = edit_image(
@@ -130,19 +261,67 @@ def worker():
                         num_inference_steps=req.steps,
                         guidance_scale=req.guidance,
                         seed=req.seed,
+                        memory_profile=req.memory_profile,
+                        step_cache=req.step_cache,
+                        info=info,
                     )
+                elif job_type == "hires":
+                    def on_progress(done: int, total: int, _job_id: str = job_id) -> None:
+                        if _job_id in job_results:
+                            job_results[_job_id].progress = {"tiles_done": done, "tiles_total": total}
 
-                    # Cleanup temporary input image (best-effort)
-                    try:
-                        p = Path(req.input_path).resolve()
-                        if INPUT_DIR in p.parents and p.exists():
-                            p.unlink()
-                    except Exception:
-                        pass
+                    output_path = hires_image(
+                        prompt=req.prompt,
+                        negative_prompt=req.negative_prompt,
+                        height=req.height,
+                        width=req.width,
+                        num_inference_steps=req.steps,
+                        guidance_scale=req.guidance,
+                        seed=req.seed,
+                        scale=req.scale,
+                        strength=req.strength,
+                        tile_size=req.tile_size,
+                        tile_overlap=req.tile_overlap,
+                        memory_profile=req.memory_profile,
+                        step_cache=req.step_cache,
+                        progress=on_progress,
+                        info=info,
+                    )
+                elif job_type == "variations":
+                    def on_variation(done: int, total: int, step: int, steps: int, _job_id: str = job_id) -> None:
+                        if _job_id in job_results:
+                            job_results[_job_id].progress = {
+                                "images_done": done,
+                                "images_total": total,
+                                "step": step,
+                                "steps": steps,
+                            }
+
+                    paths, output_path = generate_variations(
+                        prompt=req.prompt,
+                        negative_prompt=req.negative_prompt,
+                        height=req.height,
+                        width=req.width,
+                        num_inference_steps=req.steps,
+                        guidance_scale=req.guidance,
+                        seeds=req.seeds,
+                        count=req.count or 4,
+                        memory_profile=req.memory_profile,
+                        step_cache=req.step_cache,
+                        progress=on_variation,
+                        info=info,
+                    )
+                    for p in paths:
+                        STORAGE.add(p)
+                    info["images"] = [
+                        {"url": f"/assets/{p.name}", "seed": seed}
+                        for p, seed in zip(paths, info.get("seeds", []))
+                    ]
                 else:
                     raise ValueError(f"Unknown job_type: {job_type}")
 
                 relative_path = f"/assets/{Path(output_path).name}"
+                STORAGE.add(Path(output_path))
 
                 if job_id in job_results:
                     job_results[job_id].status = "completed"
@@ -150,6 +329,7 @@ def worker():
                         "url": relative_path,
                         "prompt": req.prompt,
                         "job_type": job_type,
+                        **info,
                     }
             except Exception as e:
                 print(f"Error processing job {job_id}: {e}", flush=True)
@@ -157,6 +337,18 @@ def worker():
                 if job_id in job_results:
                     job_results[job_id].status = "failed"
                     job_results[job_id].error = str(e)
+            _persist(job_id)
+
+            # Cleanup temporary input image (best-effort), whether the job succeeded or not
+            if job_inputs.pop(job_id, None) is not None and getattr(req, "cleanup_input", False):
+                try:
+                    p = Path(req.input_path).resolve()
+                    if INPUT_DIR in p.parents and p.exists():
+                        p.unlink()
+                except Exception:
+                    pass
+
+            ADMISSION.record_duration(time.monotonic() - started, _release(job_id))
 
             current_job_id = None
             job_queue.task_done()
@@ -165,14 +357,94 @@ def worker():
             print(f"Worker error: {e}", flush=True)
             time.sleep(1)
 
-# Start worker thread
+_REQUEST_TYPES = {
+    "generate": GenerateRequest,
+    "edit": EditJobRequest,
+    "hires": HiresRequest,
+    "variations": VariationsRequest,
+}
+
+
+def _recover_jobs() -> None:
+    """Reload persisted jobs: keep finished ones pollable, requeue unfinished ones."""
+    requeued = 0
+    for record in JOB_STORE.load():
+        try:
+            status = JobStatus(**record["status"])
+        except Exception as e:
+            print(f"Skipping unreadable job record: {e}", flush=True)
+            continue
+        job_results[status.job_id] = status
+        if status.status not in ("queued", "processing"):
+            continue
+
+        try:
+            req = _REQUEST_TYPES[status.job_type](**record["request"])
+        except Exception as e:
+            status.status = "failed"
+            status.error = f"Could not restore job after restart: {e}"
+            _persist(status.job_id)
+            continue
+
+        if status.job_type == "edit":
+            input_path = Path(req.input_path).resolve()
+            if not input_path.exists():
+                status.status = "failed"
+                status.error = "Input image was lost during restart"
+                _persist(status.job_id)
+                continue
+            job_inputs[status.job_id] = str(input_path)
+
+        client, cost, upload_bytes = record.get("admission") or ("", 0.0, 0)
+        ADMISSION.admit(client, cost, upload_bytes, force=True)
+        job_admission[status.job_id] = (client, cost, upload_bytes)
+
+        status.status = "queued"
+        status.position = job_queue.qsize() + 1
+        _persist(status.job_id)
+        job_queue.put((status.job_id, status.job_type, req))
+        requeued += 1
+    if requeued:
+        print(f"Requeued {requeued} unfinished job(s) from previous run", flush=True)
+
+
+@app.on_event("shutdown")
+async def _drain_on_shutdown():
+    """Graceful shutdown: stop admissions and let the current job finish (bounded)."""
+    draining.set()
+    deadline = time.monotonic() + CONFIG.shutdown_timeout_s
+    if current_job_id is not None:
+        print(f"Draining: waiting up to {CONFIG.shutdown_timeout_s:.0f}s for job {current_job_id}", flush=True)
+    while current_job_id is not None and time.monotonic() < deadline:
+        await asyncio.sleep(0.5)
+    if current_job_id is not None:
+        print(f"Job {current_job_id} did not finish in time; it will be rerun after restart", flush=True)
+    print(f"Shutdown: {job_queue.qsize()} queued job(s) persisted for next start", flush=True)
+
+
+# Start worker thread (after requeueing persisted jobs)
+def _prune_jobs() -> None:
+    """Drop expired finished jobs from memory and from the job store."""
+    finished = {
+        job_id: {"status": job.status, "created_at": job.created_at}
+        for job_id, job in list(job_results.items())
+        if job.status in ("completed", "failed")
+    }
+    for job_id in JOB_STORE.prune(finished):
+        job_results.pop(job_id, None)
+
+
+STORAGE.on_tick = _prune_jobs
+
+_recover_jobs()
 threading.Thread(target=worker, daemon=True).start()
+STORAGE.start()
 
-@app.post("/api/generate")
-def generate(req: GenerateRequest):
+def _submit_generate(req: GenerateRequest, request: Request) -> JobStatus:
+    _validate_memory_profile(req.memory_profile)
+    job_id = str(uuid.uuid4())
+    _admit(request, job_id, estimate_cost("generate", width=req.width, height=req.height, steps=req.steps))
     try:
-        job_id = str(uuid.uuid4())
-
         job_status = JobStatus(
             job_id=job_id,
             job_type="generate",
@@ -181,20 +453,177 @@ def generate(req: GenerateRequest):
             created_at=time.time(),
             prompt=req.prompt,
         )
-        job_results[job_id] = job_status
-
-        job_queue.put((job_id, "generate", req))
+        _enqueue(job_status, req)
 
         return job_status
     except Exception as e:
         print("Error queuing job:")
         traceback.print_exc()
+        _release(job_id)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/generate")
+def generate(req: GenerateRequest, request: Request):
+    return _submit_generate(req, request)
+
+
+@app.post("/api/generate/sync")
+async def generate_sync(req: GenerateRequest, request: Request, timeout: float = 600.0):
+    """Queue a generate job, wait for it and return the PNG bytes directly.
+
+    图片仍会保存到 assets/（画廊可见），但 API 客户端无需再轮询 + 二次下载。
+    超时返回 504，任务本身会继续执行，可用 X-Job-Id 查询。
+    开始停机时立即返回 503（任务已持久化，重启后继续），不拖住进程退出。
+    """
+    job = _submit_generate(req, request)
+    deadline = time.monotonic() + min(max(1.0, timeout), CONFIG.sync_max_wait_s)
+    while job.status in ("queued", "processing"):
+        if draining.is_set():
+            raise HTTPException(
+                status_code=503,
+                detail="Server is shutting down; poll the job later.",
+                headers={"X-Job-Id": job.job_id, "Retry-After": str(int(CONFIG.shutdown_timeout_s))},
+            )
+        if time.monotonic() > deadline:
+            raise HTTPException(status_code=504, detail="Timed out waiting for job", headers={"X-Job-Id": job.job_id})
+        await asyncio.sleep(0.25)
+
+    if job.status != "completed" or not job.result:
+        raise HTTPException(status_code=500, detail=job.error or "Job failed", headers={"X-Job-Id": job.job_id})
+
+    file_path = ASSETS_DIR / Path(job.result["url"]).name
+    return FileResponse(
+        file_path,
+        media_type="image/png",
+        headers={
+            "X-Job-Id": job.job_id,
+            "ETag": f'"{version_token(file_path.stat())}"',
+        },
+    )
+
+
+@app.post("/api/hires")
+def hires(req: HiresRequest, request: Request):
+    """Queue a tiled high-resolution job (generate -> upscale -> tile refine)."""
+    _validate_memory_profile(req.memory_profile)
+    try:
+        plan = plan_tiles(req.height, req.width, req.scale, req.strength, req.tile_size, req.tile_overlap)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job_id = str(uuid.uuid4())
+    cost = estimate_cost(
+        "hires",
+        width=req.width,
+        height=req.height,
+        steps=req.steps,
+        strength=plan.strength,
+        tiles=len(plan.boxes),
+        tile_pixels=plan.tile_w * plan.tile_h,
+    )
+    _admit(request, job_id, cost)
+    try:
+        job_status = JobStatus(
+            job_id=job_id,
+            job_type="hires",
+            status="queued",
+            position=job_queue.qsize() + 1,
+            created_at=time.time(),
+            prompt=req.prompt,
+        )
+        _enqueue(job_status, req)
+
+        return job_status
+    except Exception as e:
+        print("Error queuing hires job:")
+        traceback.print_exc()
+        _release(job_id)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/variations")
+def variations(req: VariationsRequest, request: Request):
+    """Queue N variations of one prompt as a single batched job (plus a contact sheet)."""
+    _validate_memory_profile(req.memory_profile)
+    n = len(req.seeds) if req.seeds else (req.count or 4)
+    if not (1 <= n <= CONFIG.max_variations):
+        raise HTTPException(status_code=400, detail=f"Variation count must be between 1 and {CONFIG.max_variations}")
+    job_id = str(uuid.uuid4())
+    _admit(request, job_id, estimate_cost("generate", width=req.width, height=req.height, steps=req.steps, count=n))
+    try:
+        job_status = JobStatus(
+            job_id=job_id,
+            job_type="variations",
+            status="queued",
+            position=job_queue.qsize() + 1,
+            created_at=time.time(),
+            prompt=req.prompt,
+        )
+        _enqueue(job_status, req)
+
+        return job_status
+    except Exception as e:
+        print("Error queuing variations job:")
+        traceback.print_exc()
+        _release(job_id)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+_IMAGE_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _find_input(image_id: str) -> Optional[Path]:
+    if not _IMAGE_ID_RE.match(image_id):
+        raise HTTPException(status_code=400, detail="Invalid image_id")
+    for p in INPUT_DIR.glob(f"{image_id}.*"):
+        return p
+    return None
+
+
+@app.post("/api/inputs")
+async def upload_input(request: Request, image: UploadFile = File(...)):
+    """Upload an input image once; later edits can refer to it by `image_id` (sha256)."""
+    try:
+        contents = await image.read()
+        ADMISSION.check_upload_size(len(contents))
+        image_id = hash_bytes(contents)
+        existing = _find_input(image_id)
+        if existing is None:
+            suffix = Path(image.filename or "input").suffix or ".png"
+            name = f"{image_id}{suffix}"
+            # 限速 + 按客户端 / 全局计入已存储字节，直到存储回收删除该文件
+            ADMISSION.admit_upload(_client_of(request), name, len(contents))
+            try:
+                (INPUT_DIR / name).write_bytes(contents)
+            except Exception:
+                ADMISSION.release_upload(name)
+                raise
+        else:
+            ADMISSION.admit_upload(_client_of(request), existing.name, 0)
+        return {"image_id": image_id, "size": len(contents), "existed": existing is not None}
+    except Rejected as r:
+        _raise_rejected(r)
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        print("Error saving input image:")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/inputs/{image_id}")
+def get_input(image_id: str):
+    """Check whether an input image is already on the server (skip re-uploading)."""
+    if _find_input(image_id) is None:
+        raise HTTPException(status_code=404, detail="Input image not found")
+    return {"image_id": image_id, "cache": INPUT_CACHE.stats()}
+
+
 @app.post("/api/edit")
 async def edit(
-    image: UploadFile = File(...),
+    request: Request,
+    image: Optional[UploadFile] = File(None),
+    image_id: Optional[str] = Form(None),
     prompt: str = Form(...),
     negative_prompt: Optional[str] = Form(None),
     strength: float = Form(0.6),
@@ -204,19 +633,48 @@ async def edit(
     steps: int = Form(25),
     guidance: float = Form(1.0),
     seed: int = Form(42),
+    memory_profile: Optional[str] = Form(None),
+    step_cache: Optional[float] = Form(None),
 ):
     """Queue an img2img edit job.
 
-    The client should send multipart/form-data.
+    The client should send multipart/form-data, with either an `image` upload
+    or the `image_id` returned by /api/inputs.
     """
-    try:
-        job_id = str(uuid.uuid4())
+    _validate_memory_profile(memory_profile)
+    if image is None and not image_id:
+        raise HTTPException(status_code=400, detail="Either image or image_id is required")
+
+    cleanup_input = True
+    if image_id:
+        found = _find_input(image_id)
+        if found is None:
+            raise HTTPException(status_code=404, detail="Input image not found; upload it via /api/inputs")
+        input_path = found
+        cleanup_input = False
+        # 刷新最近使用时间，避免被存储回收按过期删除
+        try:
+            os.utime(input_path)
+        except OSError:
+            pass
 
-        # Save uploaded image to a temp folder (best-effort cleanup happens in worker)
-        suffix = Path(image.filename or "input").suffix or ".png"
-        input_path = INPUT_DIR / f"{job_id}{suffix}"
+    job_id = str(uuid.uuid4())
+    contents = b""
+    if cleanup_input:
         contents = await image.read()
-        input_path.write_bytes(contents)
+        try:
+            ADMISSION.check_upload_size(len(contents))
+        except Rejected as r:
+            _raise_rejected(r)
+    cost = estimate_cost("edit", width=width, height=height, steps=steps, max_side=max_side)
+    _admit(request, job_id, cost, upload_bytes=len(contents))
+
+    try:
+        if cleanup_input:
+            # Save uploaded image to a temp folder (best-effort cleanup happens in worker)
+            suffix = Path(image.filename or "input").suffix or ".png"
+            input_path = INPUT_DIR / f"{job_id}{suffix}"
+            input_path.write_bytes(contents)
 
         req = EditJobRequest(
             prompt=prompt,
@@ -228,7 +686,10 @@ async def edit(
             steps=steps,
             guidance=guidance,
             seed=seed,
+            memory_profile=memory_profile,
+            step_cache=step_cache,
             input_path=str(input_path),
+            cleanup_input=cleanup_input,
         )
 
         job_status = JobStatus(
@@ -239,14 +700,14 @@ async def edit(
             created_at=time.time(),
             prompt=prompt,
         )
-        job_results[job_id] = job_status
-
-        job_queue.put((job_id, "edit", req))
+        job_inputs[job_id] = str(Path(input_path).resolve())
+        _enqueue(job_status, req)
 
         return job_status
     except Exception as e:
         print("Error queuing edit job:")
         traceback.print_exc()
+        _release(job_id)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -322,33 +783,70 @@ def get_queue():
             
     return active_jobs
 
+@app.get("/api/metrics")
+def get_metrics():
+    """Admission / queue metrics, including rejection counts by reason."""
+    return {
+        "admission": ADMISSION.metrics(),
+        "input_cache": INPUT_CACHE.stats(),
+        "storage": STORAGE.stats(),
+        "model_load": load_stats(),
+    }
+
+@app.get("/api/precision")
+def get_precision_stats():
+    """Fallback rates of the adaptive-precision fast path, per resolution."""
+    return precision_stats()
+
 @app.get("/api/assets")
-def get_assets():
+def get_assets(request: Request, offset: int = 0, limit: int = 0):
+    """List generated images (newest first).
+
+    可选分页（offset / limit，默认 limit=0 返回全部），使用 ETag 条件请求（304），
+    客户端接受 gzip 时压缩 JSON。
+    """
     try:
         files = []
         if os.path.exists("assets"):
             # List all files in assets directory, sorted by modification time (newest first)
             # Filter for image files only to be safe
-            all_files = [f for f in os.listdir("assets") if f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp'))]
-            all_files.sort(key=lambda x: os.path.getmtime(os.path.join("assets", x)), reverse=True)
-            
-            for filename in all_files:
+            entries = [
+                (f, os.stat(os.path.join("assets", f)))
+                for f in os.listdir("assets")
+                if f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp'))
+            ]
+            entries.sort(key=lambda e: e[1].st_mtime, reverse=True)
+            end = offset + limit if limit > 0 else None
+
+            for filename, st in entries[offset:end]:
                 file_path = os.path.join("assets", filename)
                 metadata = {}
+                version = ""
                 try:
-                    with Image.open(file_path) as img:
-                        # Copy info to avoid keeping file open
-                        metadata = img.info.copy()
+                    metadata = read_metadata(file_path, st)
+                    version = version_token(st)
                 except Exception as e:
                     print(f"Error reading metadata for {filename}: {e}")
 
                 files.append({
                     "name": filename,
-                    "url": f"/assets/{filename}",
+                    # ?v=<版本号> 的 URL 随文件变化而变化，可被浏览器永久缓存
+                    "url": f"/assets/{filename}?v={version}" if version else f"/assets/{filename}",
                     "path": f"assets/{filename}",
+                    "pinned": STORAGE.is_pinned(filename),
                     "metadata": metadata
                 })
-        return files
+
+        body = json.dumps(jsonable_encoder(files), ensure_ascii=False).encode("utf-8")
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if etag_matches(request.headers, etag):
+            return Response(status_code=304, headers=headers)
+
+        if "gzip" in request.headers.get("accept-encoding", "") and len(body) > 1024:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        return Response(content=body, media_type="application/json", headers=headers)
     except Exception as e:
         print("Error listing assets:")
         traceback.print_exc()
@@ -364,6 +862,8 @@ def delete_asset(filename: str):
         file_path = os.path.join("assets", filename)
         if os.path.exists(file_path):
             os.remove(file_path)
+            forget(file_path)
+            STORAGE.forget(filename)
             return {"status": "success", "message": f"Deleted {filename}"}
         else:
             raise HTTPException(status_code=404, detail="File not found")
@@ -374,6 +874,37 @@ def delete_asset(filename: str):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+def _validate_asset_name(filename: str) -> str:
+    # Validate filename to prevent directory traversal
+    if ".." in filename or "/" in filename or "\\" in filename:
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    if not (ASSETS_DIR / filename).exists():
+        raise HTTPException(status_code=404, detail="File not found")
+    return filename
+
+@app.post("/api/assets/{filename}/pin")
+def pin_asset(filename: str):
+    """Pin an asset so storage cleanup never evicts it."""
+    STORAGE.pin(_validate_asset_name(filename), True)
+    return {"status": "success", "pinned": True}
+
+@app.delete("/api/assets/{filename}/pin")
+def unpin_asset(filename: str):
+    STORAGE.pin(_validate_asset_name(filename), False)
+    return {"status": "success", "pinned": False}
+
+@app.get("/api/storage")
+def get_storage():
+    """Disk usage of assets and bytes reclaimed by the background cleanup."""
+    return STORAGE.stats()
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+
+    class _Server(uvicorn.Server):
+        def handle_exit(self, sig, frame):
+            # 收到 SIGTERM / SIGINT 立即停止接收新任务，再走 uvicorn 的优雅退出
+            draining.set()
+            super().handle_exit(sig, frame)
+
+    _Server(uvicorn.Config(app, host="0.0.0.0", port=8000)).run()
@@ -0,0 +1,140 @@
+"""Step-feature cache: reuse transformer outputs across neighbouring denoising steps.
+
+思路类似 TeaCache / First-Block-Cache：相邻步之间 transformer 的输入变化很小时，
+直接复用上一次真正计算得到的输出，跳过整次 transformer 前向。
+
+- 对每次调用，按 timestep 分组识别"第几步"和"步内第几次调用"（true CFG 下
+  cond / uncond 是两次调用，各自独立缓存）。
+- 累计输入相对 L1 变化量，低于 `threshold` 时跳过；前 `warmup` 步和最后一步
+  总是完整计算，且最多连续跳过 `max_skip` 步，避免误差积累。
+
+threshold 越大越快、画质损失越大；0 表示关闭。
+"""
+from __future__ import annotations
+
+import contextlib
+from typing import Any, Dict, Iterator, List, Optional
+
+import torch
+
+from .config import CONFIG
+
+
+def _first_tensor(value: Any) -> Optional[torch.Tensor]:
+    if isinstance(value, torch.Tensor):
+        return value
+    if isinstance(value, (list, tuple)) and value and isinstance(value[0], torch.Tensor):
+        return value[0]
+    return None
+
+
+def _count_blocks(transformer) -> int:
+    for name in ("transformer_blocks", "layers", "blocks"):
+        blocks = getattr(transformer, name, None)
+        if isinstance(blocks, torch.nn.ModuleList):
+            return len(blocks)
+    return 0
+
+
+class _Slot:
+    """Cache state for one call position within a step (e.g. cond or uncond)."""
+
+    def __init__(self) -> None:
+        self.last_input: Optional[torch.Tensor] = None
+        self.output: Any = None
+        self.accumulated = 0.0
+        self.skipped_in_row = 0
+
+
+class StepCache:
+    def __init__(self, transformer, threshold: float, total_steps: int) -> None:
+        self.transformer = transformer
+        self.threshold = float(threshold)
+        self.total_steps = int(total_steps)
+        self.warmup = int(CONFIG.step_cache_warmup)
+        self.max_skip = int(CONFIG.step_cache_max_skip)
+        self.blocks = _count_blocks(transformer)
+        self.slots: List[_Slot] = []
+        self.step = -1
+        self.call_in_step = 0
+        self.last_timestep: Optional[float] = None
+        self.calls = 0
+        self.skipped = 0
+
+    def _advance(self, timestep: Optional[float]) -> None:
+        if timestep is not None and timestep == self.last_timestep:
+            self.call_in_step += 1
+        else:
+            self.step += 1
+            self.call_in_step = 0
+        self.last_timestep = timestep
+        while len(self.slots) <= self.call_in_step:
+            self.slots.append(_Slot())
+
+    def __call__(self, forward, *args, **kwargs):
+        x = _first_tensor(kwargs.get("hidden_states", kwargs.get("x", args[0] if args else None)))
+        t = _first_tensor(kwargs.get("timestep", kwargs.get("t", args[1] if len(args) > 1 else None)))
+        self._advance(float(t.flatten()[0]) if t is not None else None)
+        self.calls += 1
+
+        slot = self.slots[self.call_in_step]
+        if x is None:
+            return forward(*args, **kwargs)
+
+        can_skip = (
+            slot.output is not None
+            and slot.last_input is not None
+            and slot.last_input.shape == x.shape
+            and self.step >= self.warmup
+            and self.step < self.total_steps - 1
+            and slot.skipped_in_row < self.max_skip
+        )
+        if can_skip:
+            prev = slot.last_input
+            change = float((x - prev).abs().mean() / (prev.abs().mean() + 1e-8))
+            if slot.accumulated + change < self.threshold:
+                slot.accumulated += change
+                slot.skipped_in_row += 1
+                self.skipped += 1
+                return slot.output
+
+        out = forward(*args, **kwargs)
+        slot.last_input = x.detach()
+        slot.output = out
+        slot.accumulated = 0.0
+        slot.skipped_in_row = 0
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threshold": self.threshold,
+            "transformer_calls": self.calls,
+            "skipped_calls": self.skipped,
+            "skipped_block_evals": self.skipped * self.blocks,
+        }
+
+
+@contextlib.contextmanager
+def step_cache(pipe, threshold: Optional[float], total_steps: int) -> Iterator[Optional[StepCache]]:
+    """Temporarily route `pipe.transformer` through a StepCache (no-op if disabled)."""
+    transformer = getattr(pipe, "transformer", None)
+    if not threshold or threshold <= 0 or transformer is None:
+        yield None
+        return
+
+    cache = StepCache(transformer, threshold, total_steps)
+    original = transformer.forward
+    # accelerate 的 offload hooks 会把 forward 挂成实例属性，退出时需原样还原。
+    had_instance_forward = "forward" in transformer.__dict__
+
+    def _forward(*args, **kwargs):
+        return cache(original, *args, **kwargs)
+
+    transformer.forward = _forward
+    try:
+        yield cache
+    finally:
+        if had_instance_forward:
+            transformer.forward = original
+        else:
+            del transformer.forward
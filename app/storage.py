@@ -0,0 +1,255 @@
+"""Disk-quota / age based retention for assets/ and .zimage_inputs/.
+
+后台线程每隔 CONFIG.gc_interval_s 执行一次 `tick()`，每次只处理一小批目录项
+（os.scandir 迭代器跨 tick 续扫），不会一次性扫描整个目录：
+
+- assets/：维护 {文件名: (大小, 最近访问/修改时间)} 索引；超过 asset_quota_mb
+  或 asset_max_age_days 时，按最久未访问优先淘汰，置顶（pinned）的文件不淘汰。
+- .zimage_inputs/：没有被任何排队 / 处理中任务引用、且超过宽限期的文件视为孤儿删除；
+  内容寻址上传（/api/inputs）按 input_max_age_hours 过期。
+
+回收的字节数累计在 stats() 中。
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Set, Tuple
+
+from .config import CONFIG
+
+
+_IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".webp")
+_CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}\.")
+
+
+class StorageManager:
+    def __init__(self, assets_dir: Path, input_dir: Path, pins_path: Path) -> None:
+        self.assets_dir = Path(assets_dir)
+        self.input_dir = Path(input_dir)
+        self._pins_path = Path(pins_path)
+        self._migrate_pins(self.assets_dir / ".pinned.json")
+        self._lock = threading.Lock()
+        # name -> (size, last used: max(mtime, last access))
+        self._assets: Dict[str, Tuple[int, float]] = {}
+        self._assets_bytes = 0
+        self._pins: Set[str] = self._load_pins()
+        self._asset_scan: Optional[Iterator[os.DirEntry]] = None
+        self._input_scan: Optional[Iterator[os.DirEntry]] = None
+        self._indexed = False
+        self._seen: Set[str] = set()
+        # 由服务端注入：排队 / 处理中任务引用的输入路径；资源被删除时的回调
+        self.live_inputs: Callable[[], Set[str]] = lambda: set()
+        self.on_asset_removed: Callable[[str], None] = lambda path: None
+        self.on_input_removed: Callable[[str], None] = lambda name: None
+        # 每次 tick 末尾调用（服务端用来清理过期的任务记录）
+        self.on_tick: Callable[[], None] = lambda: None
+        self.reclaimed_bytes = 0
+        self.evicted_assets = 0
+        self.removed_inputs = 0
+
+    # ---- pins ----
+
+    def _migrate_pins(self, legacy: Path) -> None:
+        """Move a pin list from its old, publicly served location under assets/."""
+        if not legacy.exists():
+            return
+        try:
+            if not self._pins_path.exists():
+                os.replace(legacy, self._pins_path)
+            else:
+                legacy.unlink()
+        except OSError as e:
+            print(f"[storage] could not move {legacy}: {e}", flush=True)
+
+    def _load_pins(self) -> Set[str]:
+        try:
+            return set(json.loads(self._pins_path.read_text(encoding="utf-8")))
+        except Exception:
+            return set()
+
+    def _save_pins(self) -> None:
+        tmp = self._pins_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(sorted(self._pins)), encoding="utf-8")
+        os.replace(tmp, self._pins_path)
+
+    def pin(self, name: str, pinned: bool = True) -> None:
+        with self._lock:
+            if pinned:
+                self._pins.add(name)
+            else:
+                self._pins.discard(name)
+            self._save_pins()
+
+    def is_pinned(self, name: str) -> bool:
+        return name in self._pins
+
+    # ---- index updates from the rest of the app ----
+
+    def add(self, path: Path) -> None:
+        try:
+            st = path.stat()
+        except OSError:
+            return
+        with self._lock:
+            self._put(path.name, st.st_size, st.st_mtime)
+            self._seen.add(path.name)
+
+    def touch(self, name: str) -> None:
+        with self._lock:
+            entry = self._assets.get(name)
+            if entry is not None:
+                self._assets[name] = (entry[0], time.time())
+
+    def forget(self, name: str) -> None:
+        with self._lock:
+            entry = self._assets.pop(name, None)
+            if entry is not None:
+                self._assets_bytes -= entry[0]
+            self._pins.discard(name)
+
+    def _put(self, name: str, size: int, used: float) -> None:
+        old = self._assets.get(name)
+        if old is not None:
+            self._assets_bytes -= old[0]
+            used = max(used, old[1])
+        self._assets[name] = (size, used)
+        self._assets_bytes += size
+
+    # ---- incremental GC ----
+
+    def _next_batch(self, attr: str, directory: Path) -> Tuple[list, bool]:
+        """Up to gc_batch entries from a resumable scandir; True when a pass finished."""
+        it = getattr(self, attr)
+        if it is None:
+            try:
+                it = iter(os.scandir(directory))
+            except FileNotFoundError:
+                return [], True
+            setattr(self, attr, it)
+        batch = []
+        for entry in it:
+            batch.append(entry)
+            if len(batch) >= CONFIG.gc_batch:
+                return batch, False
+        setattr(self, attr, None)
+        return batch, True
+
+    def _remove(self, path: Path) -> bool:
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except OSError as e:
+            print(f"[storage] could not remove {path}: {e}", flush=True)
+            return False
+        self.reclaimed_bytes += size
+        return True
+
+    def _scan_assets(self) -> None:
+        batch, done = self._next_batch("_asset_scan", self.assets_dir)
+        with self._lock:
+            for entry in batch:
+                if not entry.name.lower().endswith(_IMAGE_EXTS):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                self._put(entry.name, st.st_size, st.st_mtime)
+                self._seen.add(entry.name)
+            if done:
+                # 一轮扫描结束：剔除本轮未见到的条目（已被外部删除）
+                for name in [n for n in self._assets if n not in self._seen]:
+                    self._assets_bytes -= self._assets.pop(name)[0]
+                self._seen = set()
+                self._indexed = True
+
+    def _evict_assets(self) -> None:
+        if not self._indexed:
+            return
+        quota = CONFIG.asset_quota_mb * 1024 * 1024
+        max_age = CONFIG.asset_max_age_days * 86400
+        now = time.time()
+        with self._lock:
+            candidates = sorted(
+                ((used, name, size) for name, (size, used) in self._assets.items() if name not in self._pins),
+            )
+        budget = CONFIG.gc_batch
+        for used, name, size in candidates:
+            if budget <= 0:
+                break
+            over_quota = quota > 0 and self._assets_bytes > quota
+            too_old = max_age > 0 and now - used > max_age
+            if not (over_quota or too_old):
+                break
+            path = self.assets_dir / name
+            budget -= 1
+            if not self._remove(path):
+                # 删除失败：保留在索引中（仍计入配额），下一轮再试
+                continue
+            self.forget(name)
+            self.on_asset_removed(str(path))
+            self.evicted_assets += 1
+
+    def _sweep_inputs(self) -> None:
+        batch, _ = self._next_batch("_input_scan", self.input_dir)
+        if not batch:
+            return
+        live = self.live_inputs()
+        now = time.time()
+        grace = CONFIG.input_orphan_grace_s
+        max_age = CONFIG.input_max_age_hours * 3600
+        for entry in batch:
+            path = Path(entry.path)
+            if not entry.is_file() or str(path.resolve()) in live:
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            age = now - max(st.st_mtime, st.st_atime)
+            if _CONTENT_ADDRESSED.match(entry.name):
+                expired = max_age > 0 and age > max_age
+            else:
+                expired = age > grace
+            if expired and self._remove(path):
+                self.on_input_removed(entry.name)
+                self.removed_inputs += 1
+
+    def tick(self) -> None:
+        before = self.reclaimed_bytes
+        self._scan_assets()
+        self._evict_assets()
+        self._sweep_inputs()
+        self.on_tick()
+        freed = self.reclaimed_bytes - before
+        if freed:
+            print(f"[storage] reclaimed {freed} bytes (total {self.reclaimed_bytes})", flush=True)
+
+    def run_forever(self) -> None:
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"[storage] gc error: {e}", flush=True)
+            time.sleep(max(1.0, CONFIG.gc_interval_s))
+
+    def start(self) -> None:
+        threading.Thread(target=self.run_forever, daemon=True, name="storage-gc").start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "assets": len(self._assets),
+                "assets_bytes": self._assets_bytes,
+                "asset_quota_bytes": int(CONFIG.asset_quota_mb * 1024 * 1024),
+                "pinned": len(self._pins),
+                "indexed": self._indexed,
+                "reclaimed_bytes": self.reclaimed_bytes,
+                "evicted_assets": self.evicted_assets,
+                "removed_inputs": self.removed_inputs,
+            }
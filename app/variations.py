@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import inspect
+import math
+import random
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence
+
+from PIL import Image
+from PIL import PngImagePlugin
+import torch
+
+from .config import CONFIG
+from .pipeline import apply_memory_profile, get_pipeline, resolve_memory_profile
+from .precision import run_with_precision
+from .step_cache import step_cache as _step_cache
+
+
+def _contact_sheet(images: Sequence[Image.Image], thumb_side: int, gap: int = 8) -> Image.Image:
+    """Downscaled grid of all variations (roughly square layout)."""
+    cols = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / cols)
+    w, h = images[0].size
+    scale = min(1.0, thumb_side / float(max(w, h)))
+    tw, th = max(1, int(w * scale)), max(1, int(h * scale))
+
+    sheet = Image.new("RGB", (cols * tw + (cols + 1) * gap, rows * th + (rows + 1) * gap), (0, 0, 0))
+    for i, img in enumerate(images):
+        r, c = divmod(i, cols)
+        sheet.paste(img.resize((tw, th), Image.LANCZOS), (gap + c * (tw + gap), gap + r * (th + gap)))
+    return sheet
+
+
+def _encode_prompt_once(pipe, params, prompt: str, negative_prompt: Optional[str], guidance_scale: float) -> Optional[dict]:
+    """prompt_embeds kwargs shared by every batch, or None if the pipeline can't take them."""
+    encode = getattr(pipe, "encode_prompt", None)
+    if encode is None or "prompt_embeds" not in params or "num_images_per_prompt" not in params:
+        return None
+    try:
+        sig = inspect.signature(encode).parameters
+        cfg = guidance_scale > 1.0
+        kw = {"prompt": prompt}
+        if "device" in sig:
+            kw["device"] = getattr(pipe, "_execution_device", CONFIG.device)
+        if "do_classifier_free_guidance" in sig:
+            kw["do_classifier_free_guidance"] = cfg
+        if negative_prompt and "negative_prompt" in sig:
+            kw["negative_prompt"] = negative_prompt
+        with torch.inference_mode():
+            out = encode(**kw)
+    except Exception as e:
+        print(f"[variations] encode_prompt unavailable ({e}); encoding per batch", flush=True)
+        return None
+
+    embeds, negative = (out[0], out[1]) if isinstance(out, tuple) else (out, None)
+    result = {"prompt_embeds": embeds}
+    if cfg and negative is not None and "negative_prompt_embeds" in params:
+        result["negative_prompt_embeds"] = negative
+    return result
+
+
+def generate_variations(
+    prompt: str,
+    negative_prompt: Optional[str] = None,
+    height: Optional[int] = None,
+    width: Optional[int] = None,
+    num_inference_steps: Optional[int] = None,
+    guidance_scale: Optional[float] = None,
+    seeds: Optional[List[int]] = None,
+    count: int = 4,
+    output_dir: str = "assets",
+    memory_profile: Optional[str] = None,
+    step_cache: Optional[float] = None,
+    progress: Optional[Callable[[int, int, int, int], None]] = None,
+    info: Optional[dict] = None,
+) -> tuple[List[Path], Path]:
+    """Generate N variations of one prompt in batched pipeline calls.
+
+    提示词只编码一次（prompt_embeds 在各批之间复用），每张图使用各自 seed 的 generator，
+    因此单张结果与同 seed 的 generate_image() 一致。批大小受 CONFIG.variations_batch
+    限制以控制峰值内存。`progress(done_images, total_images, step, steps)` 在每个
+    去噪步（step/steps 为正在生成的这一批）以及每批完成后回调。
+
+    Returns (per-image paths, contact-sheet path).
+    """
+    if not seeds:
+        seeds = [random.randrange(2 ** 31) for _ in range(max(1, int(count)))]
+    seeds = [int(s) for s in seeds]
+    if len(seeds) > CONFIG.max_variations:
+        raise ValueError(f"At most {CONFIG.max_variations} variations per job.")
+
+    pipe = get_pipeline()
+
+    h = ((height or CONFIG.height) // 16) * 16
+    w = ((width or CONFIG.width) // 16) * 16
+    steps = num_inference_steps or CONFIG.num_inference_steps
+    scale = guidance_scale if guidance_scale is not None else CONFIG.guidance_scale
+    batch = max(1, int(CONFIG.variations_batch))
+
+    params = {}
+    try:
+        params = inspect.signature(pipe.__call__).parameters
+    except Exception:
+        pass
+
+    # 按批内图片数计算像素，选择合适的内存档位
+    profile = resolve_memory_profile(memory_profile, h, w * min(batch, len(seeds)))
+    cache_threshold = step_cache if step_cache is not None else CONFIG.step_cache_threshold
+
+    print(
+        f"Generating {len(seeds)} variations: prompt='{prompt}', h={h}, w={w}, steps={steps}, "
+        f"scale={scale}, seeds={seeds}, batch={batch}, memory={profile}",
+        flush=True,
+    )
+
+    images: List[Image.Image] = []
+    precision = "float32"
+    cache_stats: dict = {}
+    if progress is not None:
+        progress(0, len(seeds), 0, steps)
+
+    # 先应用内存档位（offload hooks 决定文本编码器所在设备），再只编码一次提示词
+    profile = apply_memory_profile(pipe, profile)
+    embeds = _encode_prompt_once(pipe, params, prompt, negative_prompt, scale)
+
+    for start in range(0, len(seeds), batch):
+        chunk = seeds[start:start + batch]
+        n = len(chunk)
+
+        kwargs = {
+            "negative_prompt": negative_prompt,
+            "height": h,
+            "width": w,
+            "num_inference_steps": steps,
+            "guidance_scale": scale,
+        }
+        if embeds is not None:
+            kwargs.pop("negative_prompt")
+            kwargs.update(embeds)
+            kwargs["num_images_per_prompt"] = n
+        elif "num_images_per_prompt" in params:
+            kwargs["prompt"] = prompt
+            kwargs["num_images_per_prompt"] = n
+        else:
+            kwargs["prompt"] = [prompt] * n
+            if negative_prompt:
+                kwargs["negative_prompt"] = [negative_prompt] * n
+
+        batch_stats: dict = {}
+
+        def _run(extra: dict, _done: int = start):
+            extra = dict(extra)
+            if progress is not None and "callback_on_step_end" in params:
+                # 与精度层的 NaN 检查回调串联
+                check = extra.pop("callback_on_step_end", None)
+
+                def _on_step(_pipe, step, timestep, callback_kwargs):
+                    if check is not None:
+                        callback_kwargs = check(_pipe, step, timestep, callback_kwargs)
+                    progress(_done, len(seeds), step + 1, steps)
+                    return callback_kwargs
+
+                extra["callback_on_step_end"] = _on_step
+            generators = [torch.Generator(device=CONFIG.device).manual_seed(s) for s in chunk]
+            with _step_cache(pipe, cache_threshold, steps) as cache:
+                result = pipe(**kwargs, generator=generators, **extra)
+            if cache is not None:
+                batch_stats.update(cache.stats())
+            return result
+
+        batch_images, profile, batch_precision = run_with_precision(pipe, "variations", profile, h, w, _run)
+        for k, v in batch_stats.items():
+            cache_stats[k] = v if k == "threshold" else cache_stats.get(k, 0) + v
+        images.extend(batch_images[:n])
+        if batch_precision != "float32":
+            precision = batch_precision
+
+        if progress is not None:
+            progress(len(images), len(seeds), steps, steps)
+
+    ts = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    out_dir = Path(output_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    paths: List[Path] = []
+    for i, (image, seed) in enumerate(zip(images, seeds)):
+        metadata = PngImagePlugin.PngInfo()
+        metadata.add_text("mode", "variations")
+        metadata.add_text("prompt", str(prompt))
+        if negative_prompt:
+            metadata.add_text("negative_prompt", str(negative_prompt))
+        metadata.add_text("height", str(h))
+        metadata.add_text("width", str(w))
+        metadata.add_text("steps", str(steps))
+        metadata.add_text("scale", str(scale))
+        metadata.add_text("seed", str(seed))
+        metadata.add_text("variation_index", str(i))
+        metadata.add_text("memory_profile", profile)
+        metadata.add_text("precision", precision)
+        path = out_dir / f"variation_{ts}_{i}.png"
+        image.save(path, pnginfo=metadata)
+        paths.append(path)
+
+    sheet_meta = PngImagePlugin.PngInfo()
+    sheet_meta.add_text("mode", "contact_sheet")
+    sheet_meta.add_text("prompt", str(prompt))
+    sheet_meta.add_text("seeds", ",".join(str(s) for s in seeds))
+    sheet_path = out_dir / f"variations_{ts}_sheet.png"
+    _contact_sheet(images, CONFIG.contact_sheet_thumb).save(sheet_path, pnginfo=sheet_meta)
+
+    if info is not None:
+        info["memory_profile"] = profile
+        info["precision"] = precision
+        info["seeds"] = seeds
+        if cache_stats:
+            info["step_cache"] = cache_stats
+
+    return paths, sheet_path
@@ -9,8 +9,10 @@ cleanup() {
     echo "🛑 Shutting down services..."
     
     if [ -n "$BACKEND_PID" ]; then
-        echo "Killing Backend (PID $BACKEND_PID)..."
-        kill $BACKEND_PID 2>/dev/null
+        # SIGTERM: backend stops accepting jobs, finishes the current one and persists the queue
+        echo "Stopping Backend (PID $BACKEND_PID), waiting for the current job to finish..."
+        kill -TERM $BACKEND_PID 2>/dev/null
+        wait $BACKEND_PID 2>/dev/null
     fi
     
     if [ -n "$FRONTEND_PID" ]; then
@@ -1,12 +1,25 @@
 #!/bin/bash
 
-echo "🛑 Force stopping Z-Image services..."
+echo "🛑 Stopping Z-Image services..."
 
-# Find and kill process on port 8000 (Backend)
+# Backend drains gracefully on SIGTERM (current job finishes, queued jobs are
+# persisted and resumed on next start); force kill only after the timeout.
+SHUTDOWN_TIMEOUT=${ZIMAGE_SHUTDOWN_TIMEOUT:-300}
+
+# Find and stop process on port 8000 (Backend)
 BACKEND_PID=$(lsof -t -i:8000)
 if [ -n "$BACKEND_PID" ]; then
-    echo "   Killing Backend on port 8000 (PID $BACKEND_PID)..."
-    kill -9 $BACKEND_PID
+    echo "   Stopping Backend on port 8000 (PID $BACKEND_PID), up to ${SHUTDOWN_TIMEOUT}s..."
+    kill -TERM $BACKEND_PID
+    WAITED=0
+    while kill -0 $BACKEND_PID 2>/dev/null && [ $WAITED -lt $((SHUTDOWN_TIMEOUT + 10)) ]; do
+        sleep 1
+        WAITED=$((WAITED + 1))
+    done
+    if kill -0 $BACKEND_PID 2>/dev/null; then
+        echo "   Backend did not exit in time, force killing..."
+        kill -9 $BACKEND_PID
+    fi
 else
     echo "   No backend found on port 8000."
 fi